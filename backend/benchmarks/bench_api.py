@@ -0,0 +1,305 @@
+"""
+API load test and regression check
+
+For each question bank size, seeds a fresh local database with synthetic
+questions, starts the app on it in a separate process and drives every route
+with concurrent clients, one scenario at a time. Reports req/s, p50/p95/p99
+latency and SQL statements per request (read from GET /metrics), and compares
+them with a stored baseline:
+
+    python benchmarks/bench_api.py --save-baseline    # record on this machine
+    python benchmarks/bench_api.py                    # exits 1 on a regression
+
+The database is a SQLite file in a temporary folder unless BENCH_DATABASE_URL
+names a scratch database (its questions and categories are replaced; see
+scratch.py). Seeds and request sequences are fixed, so runs on the same machine
+are comparable.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from loadgen import run_load, summarize
+from scratch import scratch_database_url
+
+DEFAULT_BASELINE = os.path.join(BENCHMARKS, "baseline.json")
+CATEGORIES = ("Science", "Art", "Geography", "History", "Entertainment", "Sports")
+WORDS = (
+    "river mountain planet author painter battle empire ocean desert island "
+    "element engine league stadium album composer novel poem theory crystal"
+).split()
+SEED = 2024
+
+# scenario -> (route, method) as labelled on /metrics
+ROUTES = {
+    "categories": ("/categories", "GET"),
+    "list": ("/questions", "GET"),
+    "category": ("/categories/<int:category_id>/questions", "GET"),
+    "search": ("/questions/search", "POST"),
+    "quiz": ("/quizzes", "POST"),
+    "create": ("/questions", "POST"),
+    "delete": ("/questions/<int:question_id>", "DELETE"),
+}
+# reads first; deletes last so the other scenarios see the full bank
+SCENARIOS = tuple(ROUTES)
+# scenarios whose 4xx responses are failures, not expected answers
+STRICT_SCENARIOS = ("create", "delete")
+
+
+def seed_database(database_url, size):
+    """Replace the bank with `size` deterministic questions over six categories."""
+    from flask import Flask
+
+    from models import db, setup_db, Question, Category
+
+    rng = random.Random(SEED)
+    app = Flask(__name__)
+    setup_db(app, database_url, replica_paths=[])
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(
+            Category.__table__.insert(),
+            [{"id": i, "type": name} for i, name in enumerate(CATEGORIES, 1)],
+        )
+        for start in range(0, size, 10000):
+            db.session.execute(
+                Question.__table__.insert(),
+                [
+                    {
+                        "question": "What {} is the {} of {} number {}?".format(
+                            *rng.sample(WORDS, 3), i
+                        ),
+                        "answer": rng.choice(WORDS),
+                        "category": rng.randint(1, len(CATEGORIES)),
+                        "difficulty": rng.randint(1, 5),
+                    }
+                    for i in range(start, min(start + 10000, size))
+                ],
+            )
+        db.session.commit()
+    db.get_engine(app).dispose()
+
+
+def make_scenario(name, size, rng):
+    """A make_request() callable for loadgen.run_load."""
+    pages = max(size // 10, 1)
+
+    def post(path, body):
+        return "POST", path, json.dumps(body).encode()
+
+    if name == "categories":
+        return lambda: ("GET", "/categories", b"")
+    if name == "list":
+        return lambda: ("GET", "/questions?page={}".format(rng.randint(1, min(pages, 50))), b"")
+    if name == "category":
+        return lambda: (
+            "GET",
+            "/categories/{}/questions?page={}".format(
+                rng.randint(1, len(CATEGORIES)), rng.randint(1, min(pages // 6 or 1, 20))
+            ),
+            b"",
+        )
+    if name == "search":
+        return lambda: post("/questions/search", {"searchTerm": rng.choice(WORDS)})
+    if name == "quiz":
+        return lambda: post(
+            "/quizzes",
+            {
+                "quiz_category": {"id": rng.randint(0, len(CATEGORIES))},
+                "previous_questions": rng.sample(range(1, size + 1), min(size, 5)),
+            },
+        )
+    if name == "create":
+        return lambda: post(
+            "/questions",
+            {
+                "question": "Benchmark question {}?".format(rng.random()),
+                "answer": rng.choice(WORDS),
+                "category": rng.randint(1, len(CATEGORIES)),
+                "difficulty": rng.randint(1, 5),
+            },
+        )
+    if name == "delete":
+        ids = iter(range(size, 0, -1))
+
+        def delete():
+            # stop once every seeded question is gone, rather than time 404s
+            question_id = next(ids, None)
+            if question_id is None:
+                return None
+            return "DELETE", "/questions/{}".format(question_id), b""
+
+        return delete
+    raise ValueError(name)
+
+
+METRIC_LINE = re.compile(
+    r'^trivia_request_sql_statements_(sum|count)\{route="([^"]*)",method="([^"]*)"\} (\S+)$'
+)
+
+
+def sql_statements(url):
+    """{(route, method): (statements, requests)} scraped from GET /metrics."""
+    with urllib.request.urlopen(url + "/metrics") as response:
+        body = response.read().decode()
+    totals = {}
+    for line in body.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, route, method, value = match.groups()
+            statements, requests = totals.get((route, method), (0.0, 0.0))
+            if kind == "sum":
+                statements = float(value)
+            else:
+                requests = float(value)
+            totals[(route, method)] = (statements, requests)
+    return totals
+
+
+def start_server(database_url, port):
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        env=dict(os.environ, BENCH_DATABASE_URL=database_url),
+    )
+    url = "http://127.0.0.1:{}".format(port)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + "/categories").read()
+            return server, url
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("the benchmark server exited")
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("the benchmark server did not start")
+
+
+def serve(port):
+    from werkzeug.serving import WSGIRequestHandler, run_simple
+
+    from flaskr import create_app
+
+    # keep-alive, so the load generator does not reconnect for each request
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app = create_app({"DATABASE_URL": os.environ["BENCH_DATABASE_URL"]})
+    run_simple("127.0.0.1", port, app, threaded=True)
+
+
+def run_size(database_url, size, args):
+    seed_database(database_url, size)
+    server, url = start_server(database_url, args.port)
+    results = {}
+    try:
+        # load the quiz sampler, search index and caches before measuring
+        for name in SCENARIOS[:-2]:
+            asyncio.run(run_load(url, make_scenario(name, size, random.Random(SEED)), 1, 0.2))
+        for name in SCENARIOS:
+            before = sql_statements(url)
+            make_request = make_scenario(name, size, random.Random(SEED))
+            error_status = 400 if name in STRICT_SCENARIOS else 500
+            result = asyncio.run(
+                run_load(url, make_request, args.concurrency, args.duration, error_status)
+            )
+            after = sql_statements(url)
+            key = ROUTES[name]
+            statements = after.get(key, (0, 0))[0] - before.get(key, (0, 0))[0]
+            requests = after.get(key, (0, 0))[1] - before.get(key, (0, 0))[1]
+            stats = summarize(result)
+            stats["sql_per_request"] = statements / requests if requests else 0.0
+            results[name] = stats
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Describe every result worse than its baseline beyond `tolerance`."""
+    found = []
+    for size, scenarios in results.items():
+        for name, stats in scenarios.items():
+            expected = baseline.get(size, {}).get(name)
+            if stats["errors"]:
+                found.append("{} {}: {} errors".format(size, name, stats["errors"]))
+            if expected is None:
+                continue
+            if stats["rps"] < expected["rps"] * (1 - tolerance):
+                found.append("{} {}: {:.0f} req/s, baseline {:.0f}".format(
+                    size, name, stats["rps"], expected["rps"]))
+            if stats["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+                found.append("{} {}: p95 {:.1f} ms, baseline {:.1f}".format(
+                    size, name, stats["p95_ms"], expected["p95_ms"]))
+            # statement counts do not depend on the machine; any growth counts
+            if stats["sql_per_request"] > expected["sql_per_request"] + 0.05:
+                found.append("{} {}: {:.2f} SQL/request, baseline {:.2f}".format(
+                    size, name, stats["sql_per_request"], expected["sql_per_request"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000",
+                        help="comma separated question bank sizes")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds per scenario")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative drop in req/s or rise in p95")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve(args.serve)
+
+    directory = tempfile.TemporaryDirectory()
+    database_url = scratch_database_url(
+        "sqlite:///" + os.path.join(directory.name, "bench.db")
+    )
+    results = {}
+    print("{:>7} {:<10} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}".format(
+        "size", "scenario", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms", "SQL/req"))
+    for size in [int(size) for size in args.sizes.split(",")]:
+        results[str(size)] = run_size(database_url, size, args)
+        for name, stats in results[str(size)].items():
+            print("{:>7} {:<10} {:>8.0f} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.2f}".format(
+                size, name, stats["rps"], stats["errors"], stats["p50_ms"],
+                stats["p95_ms"], stats["p99_ms"], stats["sql_per_request"]))
+    directory.cleanup()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("saved baseline to {}".format(args.baseline))
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        print("no baseline at {}; run with --save-baseline first".format(args.baseline))
+    found = regressions(results, baseline, args.tolerance)
+    for line in found:
+        print("REGRESSION " + line)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
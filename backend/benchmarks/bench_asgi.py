@@ -0,0 +1,56 @@
+"""
+WSGI vs ASGI load test
+
+Start the two serving modes against the same database, e.g.
+
+    gunicorn -w 4 --threads 8 -b 127.0.0.1:5000 'flaskr:create_app()'
+    uvicorn --factory flaskr.asgi:create_asgi_app --port 8000
+
+then drive POST /quizzes on both with the same number of concurrent clients:
+
+    python benchmarks/bench_asgi.py --concurrency 500 --duration 15
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import run_load, summarize
+
+CATEGORIES = [0, 1, 2, 3, 4, 5, 6]
+
+
+def quiz_request(rng, max_question_id):
+    def make_request():
+        previous = rng.sample(range(1, max_question_id + 1), rng.randint(0, 4))
+        body = {"quiz_category": rng.choice(CATEGORIES), "previous_questions": previous}
+        return "POST", "/quizzes", json.dumps(body).encode()
+
+    return make_request
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--wsgi-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--asgi-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--max-question-id", type=int, default=23)
+    args = parser.parse_args()
+
+    print("{:>5} {:>9} {:>7} {:>9} {:>9} {:>9}".format(
+        "mode", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms"))
+    for mode, url in (("wsgi", args.wsgi_url), ("asgi", args.asgi_url)):
+        make_request = quiz_request(random.Random(1), args.max_question_id)
+        result = asyncio.run(run_load(url, make_request, args.concurrency, args.duration))
+        stats = summarize(result)
+        print("{:>5} {:>9.1f} {:>7} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            mode, stats["rps"], stats["errors"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
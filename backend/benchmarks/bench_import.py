@@ -0,0 +1,111 @@
+"""
+Question import benchmark
+
+Imports the same NDJSON file of new questions into a SQLite database with
+- the old path: one Question(...).insert() per record, as POST /questions does
+- the new path: bulk.import_questions (chunked validation, staged batched
+  inserts and a single deduplicating INSERT ... SELECT)
+
+The new path alone then imports LARGE_IMPORT questions into a bank that holds
+LARGE_BANK questions already, a tenth of them duplicates it must skip; the
+lookup of each staged question text in the bank uses ix_questions_question.
+
+Set BENCH_DATABASE_URL to a scratch Postgres database to run both there, where
+the new path uses COPY; its questions table is emptied between runs.
+
+    python benchmarks/bench_import.py
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import text
+
+from bulk import import_questions, read_records
+from models import db, setup_db, Question, Category
+from scratch import scratch_database_url
+
+SIZES = (1_000, 10_000)
+LARGE_BANK = 1_000_000
+LARGE_IMPORT = 1_000_000
+
+
+def ndjson(count, start=0):
+    return "".join(
+        json.dumps(
+            {
+                "question": "Imported question number {}?".format(i),
+                "answer": "Answer {}".format(i),
+                "category": i % 6 + 1,
+                "difficulty": i % 5 + 1,
+            }
+        )
+        + "\n"
+        for i in range(start, start + count)
+    )
+
+
+def row_by_row(data):
+    for record in read_records(io.StringIO(data), "ndjson"):
+        Question(
+            question=record["question"],
+            answer=record["answer"],
+            category=record["category"],
+            difficulty=record["difficulty"],
+        ).insert()
+
+
+def pipeline(data):
+    import_questions(db.engine, read_records(io.StringIO(data), "ndjson"))
+
+
+def main():
+    directory = tempfile.TemporaryDirectory()
+    database_url = scratch_database_url(
+        "sqlite:///" + os.path.join(directory.name, "bench.db")
+    )
+    app = Flask(__name__)
+    setup_db(app, database_url)
+    with app.app_context():
+        db.create_all()
+        if not Category.query.count():
+            db.session.add_all(Category(type="Category {}".format(i)) for i in range(1, 7))
+            db.session.commit()
+
+        print("{:>8} {:>14} {:>14}".format("rows", "row by row s", "import s"))
+        for size in SIZES:
+            data = ndjson(size)
+            timings = []
+            for path in (row_by_row, pipeline):
+                db.session.execute(text("DELETE FROM questions"))
+                db.session.commit()
+                started = time.perf_counter()
+                path(data)
+                timings.append(time.perf_counter() - started)
+            print("{:>8} {:>14.2f} {:>14.2f}".format(size, *timings))
+
+        db.session.execute(text("DELETE FROM questions"))
+        db.session.commit()
+        pipeline(ndjson(LARGE_BANK))
+        # the last tenth of the bank comes again
+        data = ndjson(LARGE_IMPORT, LARGE_BANK - LARGE_IMPORT // 10)
+        started = time.perf_counter()
+        read, staged, inserted = import_questions(
+            db.engine, read_records(io.StringIO(data), "ndjson")
+        )
+        print(
+            "\n{} rows into a bank of {}: {:.2f} s, {} inserted, {} skipped".format(
+                read, LARGE_BANK, time.perf_counter() - started, inserted, staged - inserted
+            )
+        )
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Quiz question selection benchmark
+
+Times QuestionSampler.pick against synthetic question banks of growing size,
+with a quiz session that has already seen a handful of questions: uniform
+picks over all categories and one category, and weighted picks around a
+target difficulty. The pick cost should stay flat from 1k to 1M questions.
+The load column is the full rebuild, which runs in a background thread every
+QUESTION_REFRESH_INTERVAL, and the pull column is the cost of adding the
+PULLED rows another worker inserted, paid on the request that notices them.
+
+    python benchmarks/bench_quiz_sampling.py
+"""
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr.sampling import QuestionSampler
+
+BANK_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+CATEGORIES = 6
+DIFFICULTIES = 5
+SEEN = 20
+PICKS = 20_000
+PULLED = 100
+
+
+def rows(first, last):
+    return (
+        (question_id, question_id % CATEGORIES + 1, question_id % DIFFICULTIES + 1)
+        for question_id in range(first, last + 1)
+    )
+
+
+def main():
+    print(
+        "{:>10} {:>10} {:>10} {:>14} {:>14} {:>14}".format(
+            "questions",
+            "load (ms)",
+            "pull (ms)",
+            "all (us/pick)",
+            "cat (us/pick)",
+            "diff (us/pick)",
+        )
+    )
+    for size in BANK_SIZES:
+        sampler = QuestionSampler(None, None, rng=random.Random(42))
+        started = time.perf_counter()
+        sampler.load(rows(1, size))
+        load_time = time.perf_counter() - started
+        started = time.perf_counter()
+        sampler.extend(rows(size + 1, size + PULLED))
+        pull_time = time.perf_counter() - started
+        previous = random.Random(7).sample(range(1, size + 1), SEEN)
+        all_time = timeit.timeit(lambda: sampler.pick(0, previous), number=PICKS)
+        category_time = timeit.timeit(lambda: sampler.pick(3, previous), number=PICKS)
+        difficulty_time = timeit.timeit(
+            lambda: sampler.pick(3, previous, difficulty=4), number=PICKS
+        )
+        print(
+            "{:>10} {:>10.1f} {:>10.3f} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+                size,
+                load_time * 1e3,
+                pull_time * 1e3,
+                all_time / PICKS * 1e6,
+                category_time / PICKS * 1e6,
+                difficulty_time / PICKS * 1e6,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
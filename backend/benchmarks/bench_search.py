@@ -0,0 +1,104 @@
+"""
+Question search benchmark
+
+Compares the old `ILIKE '%term%'` scan with the in-memory trigram
+SearchIndex for question banks of growing size. The ILIKE side runs against
+an in-memory SQLite database unless BENCH_DATABASE_URL names a scratch
+database, whose questions table is dropped and recreated. The index columns
+give the time to build it (done once per worker, then in a background thread
+every QUESTION_REFRESH_INTERVAL) and the memory it holds, which every worker
+pays: about 2 GB at 1M questions, so for banks that large give the workers
+the memory or use a database-side trigram index instead. The build time
+includes the tracemalloc overhead. E.g.
+
+    BENCH_DATABASE_URL=postgresql://student@localhost/trivia_bench python benchmarks/bench_search.py
+"""
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select
+
+from flaskr.search import SearchIndex
+from models import Question
+from scratch import scratch_database_url
+
+BANK_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+TERMS = ["painting", "world cup", "ZEBRA", "river of"]
+REPEAT = 5
+WORDS = (
+    "who what which river world cup painting artist palace lake city royal "
+    "invented discovered organ medicine team country ancient first largest "
+    "actor movie title author oscar nomination boxer original name"
+).split()
+
+
+def synthetic_questions(size, rng):
+    for question_id in range(1, size + 1):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+        yield {
+            "id": question_id,
+            "question": text.capitalize() + "?",
+            "answer": "answer",
+            "category": str(question_id % 6 + 1),
+            "difficulty": question_id % 5 + 1,
+        }
+
+
+def main():
+    url = scratch_database_url("sqlite://")
+    table = Question.__table__
+    print(
+        "{:>10} {:>10} {:>10} {:>12} {:>12} {:>9}".format(
+            "questions", "build (s)", "size (MB)", "ilike (ms)", "index (ms)", "speedup"
+        )
+    )
+    for size in BANK_SIZES:
+        engine = create_engine(url)
+        table.drop(engine, checkfirst=True)
+        table.create(engine)
+        rows = list(synthetic_questions(size, random.Random(size)))
+        with engine.begin() as connection:
+            connection.execute(table.insert(), rows)
+
+        index = SearchIndex(refresh_interval=None)
+        tracemalloc.start()
+        started = timeit.default_timer()
+        index.load((row["id"], row["question"]) for row in rows)
+        build_time = timeit.default_timer() - started
+        index_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        with engine.connect() as connection:
+
+            def ilike():
+                for term in TERMS:
+                    connection.execute(
+                        select(table.c.id).where(table.c.question.ilike("%{}%".format(term)))
+                    ).all()
+
+            def indexed():
+                for term in TERMS:
+                    index.search(term)
+
+            ilike_time = min(timeit.repeat(ilike, number=1, repeat=REPEAT)) / len(TERMS)
+            index_time = min(timeit.repeat(indexed, number=1, repeat=REPEAT)) / len(TERMS)
+        table.drop(engine)
+        print(
+            "{:>10} {:>10.1f} {:>10.1f} {:>12.3f} {:>12.3f} {:>8.1f}x".format(
+                size,
+                build_time,
+                index_size / 2**20,
+                ilike_time * 1e3,
+                index_time * 1e3,
+                ilike_time / index_time,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Question list serialization benchmark
+
+Serializes 10k questions read from an in-memory SQLite database with
+- the old path: ORM entities, Question.format() dicts and jsonify
+- the new path: plain column rows and memoized per-question JSON fragments,
+  cold (first request) and warm (fragments already cached)
+
+    python benchmarks/bench_serialization.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+
+from flaskr.serialization import QuestionFragments, question_rows
+from models import db, setup_db, Question
+
+QUESTIONS = 10_000
+REPEAT = 5
+
+
+def main():
+    app = Flask(__name__)
+    setup_db(app, "sqlite://")
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            Question.__table__.insert(),
+            [
+                {
+                    "question": "Question number {} about something?".format(i),
+                    "answer": "Answer {}".format(i),
+                    "category": str(i % 6 + 1),
+                    "difficulty": i % 5 + 1,
+                }
+                for i in range(QUESTIONS)
+            ],
+        )
+        db.session.commit()
+
+        def old_path():
+            questions = Question.query.order_by(Question.id).all()
+            body = jsonify({"success": True, "questions": [q.format() for q in questions]})
+            db.session.expunge_all()
+            return body
+
+        fragments = QuestionFragments()
+
+        def new_path_cold():
+            fragments.clear()
+            return fragments.response(question_rows().order_by(Question.id).all(), success=True)
+
+        def new_path_warm():
+            return fragments.response(question_rows().order_by(Question.id).all(), success=True)
+
+        new_path_warm()
+        print("{:<22} {:>10}".format("path", "ms / 10k"))
+        for name, path in (
+            ("orm + format + jsonify", old_path),
+            ("rows + fragments cold", new_path_cold),
+            ("rows + fragments warm", new_path_warm),
+        ):
+            seconds = min(timeit.repeat(path, number=1, repeat=REPEAT))
+            print("{:<22} {:>10.1f}".format(name, seconds * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Minimal concurrent HTTP/1.1 load generator
+
+Each simulated client keeps one keep-alive connection open and sends its
+requests back to back, so the server sees `concurrency` requests in flight.
+Only the standard library is used.
+"""
+import asyncio
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+LoadResult = namedtuple("LoadResult", ["requests", "errors", "seconds", "latencies"])
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(result):
+    latencies = sorted(result.latencies)
+    return {
+        "requests": result.requests,
+        "errors": result.errors,
+        "rps": result.requests / result.seconds if result.seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1e3,
+        "p95_ms": percentile(latencies, 0.95) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+    }
+
+
+async def _request(reader, writer, host, method, path, body):
+    head = "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\n".format(
+        method, path, host, len(body)
+    )
+    if body:
+        head += "Content-Type: application/json\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by server")
+    version, status = status_line.split()[:2]
+    status = int(status)
+    length, chunked = 0, False
+    # HTTP/1.0 servers (e.g. the Flask dev server) close after each response
+    close = version == b"HTTP/1.0"
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value:
+            chunked = True
+        elif name == "connection":
+            close = value == "close"
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status, close
+
+
+async def _client(base, make_request, deadline, result, error_status):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        request = make_request()
+        if request is None:
+            break
+        method, path, body = request
+        if writer is None:
+            reader, writer = await asyncio.open_connection(base.hostname, base.port or 80)
+        started = time.perf_counter()
+        try:
+            status, close = await _request(reader, writer, base.netloc, method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            result["errors"] += 1
+            writer.close()
+            writer = None
+            continue
+        result["latencies"].append(time.perf_counter() - started)
+        result["requests"] += 1
+        if status >= error_status:
+            result["errors"] += 1
+        if close:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(url, make_request, concurrency=50, duration=10.0, error_status=500):
+    """Drive `url` with `concurrency` clients for `duration` seconds.
+
+    `make_request()` returns a `(method, path, body bytes)` tuple per request,
+    or None once it has nothing left to send. Responses with a status of
+    `error_status` or above count as errors.
+    """
+    base = urlsplit(url)
+    result = {"requests": 0, "errors": 0, "latencies": []}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(
+        *(
+            _client(base, make_request, deadline, result, error_status)
+            for _ in range(concurrency)
+        )
+    )
+    return LoadResult(
+        result["requests"], result["errors"], time.perf_counter() - started, result["latencies"]
+    )
@@ -0,0 +1,44 @@
+"""
+Scratch databases for the benchmarks
+
+The benchmarks drop, empty or refill the questions and categories of their
+database, so they never use the app's DATABASE_URL. They run on a throwaway
+SQLite database unless BENCH_DATABASE_URL names a scratch one, e.g.
+
+    BENCH_DATABASE_URL=postgresql://student@localhost/trivia_bench python benchmarks/bench_api.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import database_url
+
+
+def app_database_urls():
+    """The databases the app would use, from the environment and .env."""
+    urls = {os.environ.get("DATABASE_URL")}
+    try:
+        urls.add(database_url())
+    except RuntimeError:
+        pass
+    return urls - {None, ""}
+
+
+def scratch_database_url(default):
+    """BENCH_DATABASE_URL, or `default` when it is not set.
+
+    Exits when BENCH_DATABASE_URL is the app's database, or when it is not set
+    but DATABASE_URL is exported, which suggests a database was meant.
+    """
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if not url:
+        if os.environ.get("DATABASE_URL"):
+            sys.exit(
+                "DATABASE_URL is ignored by the benchmarks; set BENCH_DATABASE_URL "
+                "to a scratch database, or unset DATABASE_URL to use SQLite"
+            )
+        return default
+    if url in app_database_urls():
+        sys.exit("BENCH_DATABASE_URL is the app's database; use a scratch database")
+    return url
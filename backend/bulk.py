@@ -0,0 +1,357 @@
+"""
+Bulk import and export of the question bank
+
+    flask export-questions questions.ndjson
+    flask import-questions questions.csv --format csv
+    flask export-categories categories.csv --format csv
+    flask import-categories categories.ndjson
+
+Files are streamed in chunks, so memory stays bounded whatever their size.
+Imported questions are validated per chunk and staged in a temporary table,
+with PostgreSQL COPY where available and batched INSERTs otherwise. A single
+INSERT ... SELECT then adds the staged questions whose text is not in the
+bank yet and whose category exists, all in one transaction.
+"""
+import csv
+import io
+import json
+import sys
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db, Question, Category
+
+CHUNK_SIZE = 10000
+QUESTION_FIELDS = ("id", "question", "answer", "category", "difficulty")
+CATEGORY_FIELDS = ("id", "type")
+FORMATS = ("ndjson", "csv")
+
+
+"""
+InvalidRecord
+    stands in for an NDJSON line that is not valid JSON, so that the
+    importers skip and report it like any other invalid record
+
+"""
+
+
+class InvalidRecord:
+    __slots__ = ("reason",)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def read_records(stream, format):
+    """Yield dicts from an NDJSON or CSV text stream."""
+    if format == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield InvalidRecord("invalid JSON: {}".format(e))
+
+
+def chunks(records, size=CHUNK_SIZE):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validate_question(record):
+    """Return a (question, answer, category, difficulty) tuple, or raise ValueError.
+
+    These are the rules POST /questions applies to a submitted question.
+    """
+    if isinstance(record, InvalidRecord):
+        raise ValueError(record.reason)
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    question = record.get("question")
+    answer = record.get("answer")
+    if not question or not answer:
+        raise ValueError("question and answer are required")
+    try:
+        category = int(record.get("category"))
+        difficulty = int(record.get("difficulty"))
+    except (TypeError, ValueError):
+        raise ValueError("category and difficulty must be integers")
+    return question, answer, category, difficulty
+
+
+def validate_category(record):
+    """Return an (id, type) tuple, or raise ValueError."""
+    if isinstance(record, InvalidRecord):
+        raise ValueError(record.reason)
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    try:
+        category_id = int(record.get("id"))
+    except (TypeError, ValueError):
+        raise ValueError("id must be an integer")
+    if not record.get("type"):
+        raise ValueError("type is required")
+    return category_id, record["type"]
+
+
+"""
+Progress
+    prints rows done and throughput at most once a second
+
+"""
+
+
+class Progress:
+    def __init__(self, label, out=sys.stderr):
+        self.label = label
+        self.out = out
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def advance(self, rows):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self._reported >= 1:
+            self._reported = now
+            self.report()
+
+    def report(self, suffix=""):
+        elapsed = self.elapsed
+        rate = self.rows / elapsed if elapsed else 0
+        click.echo(
+            "{}: {} rows in {:.1f}s ({:.0f} rows/s){}".format(
+                self.label, self.rows, elapsed, rate, suffix
+            ),
+            file=self.out,
+        )
+
+
+def _stage_chunk(connection, rows):
+    """Add (line, question, answer, category, difficulty) rows to the staging table."""
+    if connection.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            "COPY questions_import (line, question, answer, category, difficulty) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    else:
+        connection.execute(
+            text(
+                "INSERT INTO questions_import (line, question, answer, category, difficulty) "
+                "VALUES (:line, :question, :answer, :category, :difficulty)"
+            ),
+            [
+                {"line": n, "question": q, "answer": a, "category": c, "difficulty": d}
+                for n, q, a, c, d in rows
+            ],
+        )
+
+
+def import_questions(engine, records, progress=None, errors=None):
+    """Import question records and return (read, staged, inserted) counts.
+
+    Invalid records are skipped; `errors` collects (record number, reason).
+    """
+    read = staged = 0
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TEMPORARY TABLE questions_import (line INTEGER, "
+                "question TEXT, answer TEXT, category INTEGER, difficulty INTEGER)"
+            )
+        )
+        for chunk in chunks(records):
+            rows = []
+            for record in chunk:
+                read += 1
+                try:
+                    rows.append((read,) + validate_question(record))
+                except ValueError as e:
+                    if errors is not None:
+                        errors.append((read, str(e)))
+            if rows:
+                _stage_chunk(connection, rows)
+                staged += len(rows)
+            if progress is not None:
+                progress.advance(len(chunk))
+
+        # keep the first copy of each text, and only texts not in the bank yet
+        result = connection.execute(
+            text(
+                "INSERT INTO questions (question, answer, category, difficulty) "
+                "SELECT s.question, s.answer, s.category, s.difficulty "
+                "FROM (SELECT question, answer, category, difficulty, "
+                "ROW_NUMBER() OVER (PARTITION BY question ORDER BY line) AS copy "
+                "FROM questions_import) AS s "
+                "WHERE s.copy = 1 "
+                "AND s.category IN (SELECT id FROM categories) "
+                "AND NOT EXISTS (SELECT 1 FROM questions q WHERE q.question = s.question)"
+            )
+        )
+        inserted = result.rowcount
+        connection.execute(text("DROP TABLE questions_import"))
+    return read, staged, inserted
+
+
+def import_categories(engine, records, errors=None):
+    """Add the category records whose id is new; return (read, inserted).
+
+    Invalid records are skipped; `errors` collects (record number, reason).
+    """
+    read = inserted = 0
+    with engine.begin() as connection:
+        existing = {row[0] for row in connection.execute(text("SELECT id FROM categories"))}
+        for chunk in chunks(records):
+            rows = []
+            for record in chunk:
+                read += 1
+                try:
+                    category_id, category_type = validate_category(record)
+                except ValueError as e:
+                    if errors is not None:
+                        errors.append((read, str(e)))
+                    continue
+                if category_id not in existing:
+                    existing.add(category_id)
+                    rows.append({"id": category_id, "type": category_type})
+            if rows:
+                connection.execute(Category.__table__.insert(), rows)
+                inserted += len(rows)
+        if inserted and connection.dialect.name == "postgresql":
+            # the ids were given explicitly; move the sequence past them
+            connection.execute(
+                text(
+                    "SELECT setval('categories_id_seq', (SELECT MAX(id) FROM categories))"
+                )
+            )
+    return read, inserted
+
+
+def export_table(engine, table, fields, out, format, progress=None):
+    """Stream every row of `table` to `out` as NDJSON or CSV; return the row count."""
+    count = 0
+    with engine.connect() as connection:
+        if format == "csv" and connection.dialect.name == "postgresql":
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                "COPY (SELECT {} FROM {} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)".format(
+                    ", ".join(fields), table.name
+                ),
+                out,
+            )
+            return cursor.rowcount
+
+        columns = [table.c[field] for field in fields]
+        result = connection.execution_options(stream_results=True).execute(
+            table.select().with_only_columns(columns).order_by(table.c.id)
+        )
+        writer = None
+        if format == "csv":
+            writer = csv.writer(out)
+            writer.writerow(fields)
+        for rows in result.partitions(CHUNK_SIZE):
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                out.write(
+                    "".join(json.dumps(dict(zip(fields, row))) + "\n" for row in rows)
+                )
+            count += len(rows)
+            if progress is not None:
+                progress.advance(len(rows))
+    return count
+
+
+format_option = click.option(
+    "--format", "format", type=click.Choice(FORMATS), default="ndjson", show_default=True
+)
+
+
+@click.command("import-questions")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@format_option
+@with_appcontext
+def import_questions_command(source, format):
+    """Import questions from SOURCE ('-' for stdin)."""
+    progress = Progress("import-questions")
+    errors = []
+    read, staged, inserted = import_questions(
+        db.engine, read_records(source, format), progress, errors
+    )
+    for number, reason in errors[:10]:
+        click.echo("record {}: {}".format(number, reason), err=True)
+    progress.report(
+        ", {} invalid, {} duplicate or unknown category, {} added".format(
+            read - staged, staged - inserted, inserted
+        )
+    )
+
+
+@click.command("export-questions")
+@click.argument("target", type=click.File("w", encoding="utf-8"))
+@format_option
+@with_appcontext
+def export_questions_command(target, format):
+    """Export every question to TARGET ('-' for stdout)."""
+    progress = Progress("export-questions")
+    count = export_table(
+        db.engine, Question.__table__, QUESTION_FIELDS, target, format, progress
+    )
+    progress.rows = count
+    progress.report()
+
+
+@click.command("import-categories")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@format_option
+@with_appcontext
+def import_categories_command(source, format):
+    """Import categories whose id is new from SOURCE ('-' for stdin)."""
+    errors = []
+    read, inserted = import_categories(db.engine, read_records(source, format), errors)
+    for number, reason in errors[:10]:
+        click.echo("record {}: {}".format(number, reason), err=True)
+    click.echo(
+        "import-categories: {} read, {} invalid, {} added".format(
+            read, len(errors), inserted
+        ),
+        err=True,
+    )
+
+
+@click.command("export-categories")
+@click.argument("target", type=click.File("w", encoding="utf-8"))
+@format_option
+@with_appcontext
+def export_categories_command(target, format):
+    """Export every category to TARGET ('-' for stdout)."""
+    count = export_table(db.engine, Category.__table__, CATEGORY_FIELDS, target, format)
+    click.echo("export-categories: {} rows".format(count), err=True)
+
+
+COMMANDS = (
+    import_questions_command,
+    export_questions_command,
+    import_categories_command,
+    export_categories_command,
+)
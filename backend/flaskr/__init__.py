@@ -1,80 +1,206 @@
 import os
+import json
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import desc
 from flask_cors import CORS
-import random
 from requests.exceptions import HTTPError
 
 
-from models import setup_db, Question, Category
+from models import setup_db, config_value, pool_status, Question
+from migrations import upgrade_db_command
+import bulk
+from routing import read_only
+from .cache import CategoryCache, QuestionCounter, QuestionWatch
+from .caching import cache_control, init_caching
+from .coalescing import coalesced, init_coalescing
+from .compression import init_compression
+from .metrics import init_metrics
+from .pagination import page_args, paginate, paginate_ids
+from .ratelimit import init_rate_limit
+from .sampling import (
+    ADAPTIVE_START,
+    QuestionSampler,
+    adapt_difficulty,
+    category_key,
+    parse_difficulty,
+)
+from .search import SearchIndex
+from .serialization import STREAM_BATCH_SIZE, QuestionFragments, question_rows
+from .sessions import MemorySessionStore
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+MAX_BULK_QUESTIONS = 10000
+QUESTION_FIELDS = ("question", "answer", "category", "difficulty")
+
+
+def question_from_body(body):
+    """Build a Question from a request body, aborting with 400 on missing, empty or non-numeric fields."""
+    if not isinstance(body, dict) or any(
+        body.get(field) in (None, "") for field in QUESTION_FIELDS
+    ):
+        abort(400)
+    try:
+        category = int(body.get("category"))
+        difficulty = int(body.get("difficulty"))
+    except (TypeError, ValueError):
+        abort(400)
+    return Question(
+        question=body.get("question"),
+        answer=body.get("answer"),
+        category=category,
+        difficulty=difficulty,
+    )
+
+
+def questions_from_request():
+    """Read the questions of a bulk request, sent as a JSON array or as NDJSON."""
+    if request.mimetype == "application/x-ndjson":
+        try:
+            bodies = [
+                json.loads(line)
+                for line in request.get_data(as_text=True).splitlines()
+                if line.strip()
+            ]
+        except ValueError:
+            abort(400)
+    else:
+        bodies = request.get_json()
+        if isinstance(bodies, dict):
+            bodies = bodies.get("questions")
+    if not isinstance(bodies, list) or not 0 < len(bodies) <= MAX_BULK_QUESTIONS:
+        abort(400)
+    return [question_from_body(body) for body in bodies]
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    # settings here take precedence over .env, which is only read for the
+    # ones they leave out
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     setup_db(app)
+    app.cli.add_command(upgrade_db_command)
+    for command in bulk.COMMANDS:
+        app.cli.add_command(command)
 
-    CORS(app)
+    # preflight answers list the allowed headers and methods once, and
+    # browsers may reuse them for CORS_MAX_AGE seconds
+    CORS(
+        app,
+        allow_headers=["Content-Type", "Authorization"],
+        methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+        max_age=config_value("CORS_MAX_AGE", 3600, int, app.config),
+    )
 
-    @app.after_request
-    def after_request(response):
-        response.headers.add(
-            "Access-Control-Allow-Headers", "Content-Type, Authorization"
+    # request metrics on /metrics; METRICS_ENABLED=false leaves them out entirely
+    if config_value("METRICS_ENABLED", True, bool, app.config):
+        slow_request_ms = config_value("SLOW_REQUEST_MS", None, float, app.config)
+        init_metrics(
+            app, slow_request_ms / 1000 if slow_request_ms is not None else None
         )
-        response.headers.add(
-            "Access-Control-Allow-Headers", "GET, POST, PATCH, DELETE, OPTIONS"
+
+    # question and category counts and highest ids, read at most every
+    # QUESTION_CHECK_INTERVAL seconds to find the writes of other workers
+    question_watch = QuestionWatch(
+        config_value("QUESTION_CHECK_INTERVAL", 1.0, float, app.config)
+    )
+    app.extensions["question_watch"] = question_watch
+
+    # Cache-Control and ETags from the question watch; gzip/brotli for larger bodies
+    init_caching(app, question_watch)
+    init_compression(app, config_value("COMPRESS_MIN_SIZE", 500, int, app.config))
+
+    # identical concurrent reads share one query, reused for READ_CACHE_TTL seconds
+    if config_value("COALESCE_READS", True, bool, app.config):
+        init_coalescing(app, config_value("READ_CACHE_TTL", 1.0, float, app.config))
+
+    # token bucket per client IP and route; off unless RATE_LIMIT is set
+    rate_limit = config_value("RATE_LIMIT", None, float, app.config)
+    if rate_limit:
+        init_rate_limit(
+            app, rate_limit, config_value("RATE_LIMIT_BURST", None, float, app.config)
         )
-        return response
+
+    question_refresh_interval = config_value(
+        "QUESTION_REFRESH_INTERVAL", 300, float, app.config
+    )
+    # in-memory question ids used to pick quiz questions
+    sampler = QuestionSampler(question_refresh_interval, question_watch)
+    app.extensions["question_sampler"] = sampler
+    # server-side quiz sessions; replace with a shared SessionStore if needed
+    app.extensions["quiz_sessions"] = MemorySessionStore()
+    # category map shared by /categories and /questions
+    category_cache = CategoryCache()
+    app.extensions["category_cache"] = category_cache
+    # question totals maintained on insert and delete
+    question_counter = QuestionCounter()
+    app.extensions["question_counter"] = question_counter
+    # trigram index behind /questions/search, sharing the sampler's watch
+    search_index = SearchIndex(question_refresh_interval, question_watch)
+    app.extensions["search_index"] = search_index
+    # encoded JSON of each question, reused across list responses
+    fragments = QuestionFragments()
+    app.extensions["question_fragments"] = fragments
 
     # an endpoint to handle GET requests for all available categories
     @app.route("/categories", methods=["GET"])
+    @cache_control("public, max-age=60", etag="categories")
+    @read_only
     def get_categories():
         try:
-            categories = Category.query.order_by(Category.id).all()
-            formatted_categories = {
-                category.id: category.type for category in categories
-            }
-
-            if len(formatted_categories) == 0:
-                abort(404)
-
-            return jsonify({"success": True, "categories": formatted_categories})
-
-        except KeyError:
-            abort(422)
+            cached = category_cache.get()
         except Exception as e:
             print(e)
             abort(500)
 
+        if len(cached.categories) == 0:
+            abort(404)
+        return app.response_class(cached.body, mimetype="application/json")
+
     # an endpoint to handle GET requests for all available questions with pagination
     @app.route("/questions", methods=["GET"])
+    @cache_control("no-cache", etag="questions")
+    @coalesced(version="questions")
+    @read_only
     def get_questions():
+        page, after, limit = page_args(QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE)
         try:
-            page = request.args.get("page", 1, type=int)
-            questions = Question.query.paginate(page=page, per_page=10)
-            formatted_questions = [question.format() for question in questions.items]
-            if len(formatted_questions) == 0:
-                abort(404)
-            return jsonify(
-                {
-                    "success": True,
-                    "questions": formatted_questions,
-                    "total_questions": questions.total,
-                    "categories": {
-                        category.id: category.type for category in Category.query.all()
-                    },
-                    "current_category": "None",
-                }
-            )
-        except KeyError:
-            abort(422)
+            questions, next_after = paginate(question_rows(), page, after, limit)
+            total_questions = question_counter.count()
+            categories = category_cache.categories()
         except Exception as e:
             print(e)
             abort(500)
 
+        if len(questions) == 0:
+            abort(404)
+        return fragments.response(
+            questions,
+            success=True,
+            total_questions=total_questions,
+            next_after=next_after,
+            categories=categories,
+            current_category="None",
+        )
+
+    def questions_added(questions):
+        # Question.insert_all's Core INSERT fires no mapper events
+        app.extensions["data_version"].bump("questions")
+        for question in questions:
+            sampler.add(question.id, question.category, question.difficulty)
+            question_counter.add(question.category)
+            search_index.add(question.id, question.question)
+
+    def question_deleted(question):
+        sampler.remove(question.id)
+        question_counter.remove(question.category)
+        search_index.remove(question.id)
+        # re-read the count before the index compares its size with it
+        question_watch.expire()
+
     # an endpoint to handle DELETE requests for deleting a question
     @app.route("/questions/<int:question_id>", methods=["DELETE"])
     def delete_question(question_id):
@@ -84,6 +210,7 @@ def create_app(test_config=None):
             abort(404)
         try:
             question.delete()
+            question_deleted(question)
 
             return jsonify(
                 {
@@ -96,94 +223,117 @@ def create_app(test_config=None):
     # an endpoint to handle POST requests for adding a new question
     @app.route("/questions", methods=["POST"])
     def add_questions():
-        body = request.get_json()
-        if (
-            "question" not in body
-            or "answer" not in body
-            or "category" not in body
-            or "difficulty" not in body
-        ):
-            abort(400)
+        question = question_from_body(request.get_json())
         try:
-            new_question = body.get("question")
-            new_answer = body.get("answer")
-            new_category = body.get("category")
-            new_difficulty = body.get("difficulty")
-
-            question = Question(
-                question=new_question,
-                answer=new_answer,
-                category=new_category,
-                difficulty=new_difficulty,
-            )
-            if any(value == '' for value in question.__dict__.values()):
-                print("At least one value is an empty string.")
-                abort(400)
-            else:
-                print("No empty strings found.")
             question.insert()
-            formatted_questions = [
-                question.format() for question in Question.query.all()
-            ]
+            questions_added([question])
+            response = {
+                "success": True,
+                "created": question.id,
+                "question": question.format(),
+                "total_questions": question_counter.count(),
+            }
+            # the full question list is only sent to clients that ask for it
+            if request.args.get("include") == "questions":
+                response["questions"] = [
+                    question.format()
+                    for question in Question.query.order_by(Question.id).all()
+                ]
+            return jsonify(response)
+        except KeyError:
+            abort(422)
+        except Exception as e:
+            print(e)
+            abort(500)
+
+    # an endpoint to add many questions in one transaction
+    @app.route("/questions/bulk", methods=["POST"])
+    def add_questions_in_bulk():
+        questions = questions_from_request()
+        try:
+            Question.insert_all(questions)
+            questions_added(questions)
             return jsonify(
                 {
                     "success": True,
-                    "created": question.id,
-                    "questions": formatted_questions,
-                    "total_questions": len(formatted_questions),
+                    "created": [question.id for question in questions],
+                    "total_questions": question_counter.count(),
                 }
             )
-        except KeyError:
-            abort(422)
         except Exception as e:
             print(e)
             abort(500)
 
     @app.route("/questions/search", methods=["POST"])
+    @coalesced(version="questions")
+    @read_only
     def search_questions_by_term():
         body = request.get_json()
         search_term = body.get("searchTerm")
-        search_results = Question.query.filter(
-            Question.question.ilike("%{}%".format(search_term))
-        ).all()
-        formatted_questions = [question.format() for question in search_results]
-        if len(formatted_questions) == 0:
-            abort(404)
-        if search_term == None:
+        if not isinstance(search_term, str):
             abort(400)
-
+        page, after, limit = page_args(QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE)
         try:
-            return jsonify(
-                {
-                    "success": True,
-                    "questions": formatted_questions,
-                    "total_questions": len(formatted_questions),
-                }
+            matching_ids = search_index.search(search_term)
+            page_ids, next_after = paginate_ids(matching_ids, page, after, limit)
+            search_results = (
+                question_rows()
+                .filter(Question.id.in_(page_ids))
+                .order_by(Question.id)
+                .all()
             )
         except Exception as e:
             print(e)
             abort(500)
 
+        if len(search_results) == 0:
+            abort(404)
+        return fragments.response(
+            search_results,
+            success=True,
+            total_questions=len(matching_ids),
+            next_after=next_after,
+        )
+
     @app.route("/categories/<int:category_id>/questions", methods=["GET"])
+    @cache_control("no-cache", etag="questions")
+    @coalesced(version="questions")
+    @read_only
     def get_questions_by_category(category_id):
-        questions = Question.query.filter(Question.category == category_id).all()
-        formatted_questions = [question.format() for question in questions]
-        if len(formatted_questions) == 0:
-            abort(404)
+        stream = request.args.get("stream")
+        if stream not in (None, "ndjson", "json"):
+            abort(400)
+        page, after, limit = page_args(QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE)
+        query = question_rows().filter(Question.category == category_id)
         try:
-            return jsonify(
-                {
-                    "success": True,
-                    "questions": formatted_questions,
-                    "total_questions": len(formatted_questions),
-                    "current_category": category_id,
-                }
-            )
+            total_questions = question_counter.count(category_id)
+            if stream is not None and total_questions > 0:
+                # the whole category, with constant memory however big it is
+                rows = query.order_by(Question.id).yield_per(STREAM_BATCH_SIZE)
+                return fragments.stream(
+                    rows,
+                    stream,
+                    success=True,
+                    total_questions=total_questions,
+                    current_category=category_id,
+                )
+            questions, next_after = paginate(query, page, after, limit)
         except Exception as e:
             print(e)
             abort(500)
 
+        if total_questions == 0 or len(questions) == 0:
+            abort(404)
+        return fragments.response(
+            questions,
+            success=True,
+            total_questions=total_questions,
+            next_after=next_after,
+            current_category=category_id,
+        )
+
     @app.route("/quizzes", methods=["POST"])
+    @read_only
     def get_questions_for_quizz():
         body = request.get_json()
         quiz_category = body.get("quiz_category")
@@ -191,23 +341,104 @@ def create_app(test_config=None):
 
         if "quiz_category" not in body or "previous_questions" not in body:
             abort(400)
+        try:
+            difficulty = parse_difficulty(body.get("difficulty"))
+        except ValueError:
+            abort(400)
 
-        if quiz_category == 0:
-            random_questions = Question.query.filter(
-                Question.id.not_in(previous_questions)
-            ).all()
-        else:
-            random_questions = Question.query.filter(
-                Question.id.not_in(previous_questions),
-                Question.category == quiz_category,
-            ).all()
         try:
-            random_question = random.choice(random_questions)
+            random_question = sampler.next_question(
+                quiz_category, previous_questions, difficulty
+            )
+            if random_question is None:
+                raise IndexError("no unseen questions left in this category")
             return jsonify({"success": True, "question": random_question.format()})
         except Exception as e:
             print(e)
             abort(500)
 
+    # an endpoint to start a quiz whose asked questions are kept on the server
+    @app.route("/quizzes/sessions", methods=["POST"])
+    def start_quiz_session():
+        body = request.get_json()
+        if body is None or "quiz_category" not in body:
+            abort(400)
+        adaptive = bool(body.get("adaptive", False))
+        try:
+            difficulty = parse_difficulty(body.get("difficulty"))
+        except ValueError:
+            abort(400)
+        if adaptive and difficulty is None:
+            difficulty = ADAPTIVE_START
+        session = app.extensions["quiz_sessions"].create(
+            category_key(body.get("quiz_category")), difficulty, adaptive
+        )
+        return jsonify(
+            {
+                "success": True,
+                "session_id": session.id,
+                "quiz_category": session.category,
+                "difficulty": session.difficulty,
+                "adaptive": session.adaptive,
+            }
+        )
+
+    # an endpoint to get the next unseen question of a quiz session
+    @app.route("/quizzes/sessions/<session_id>/next", methods=["POST"])
+    @read_only
+    def get_next_session_question(session_id):
+        sessions = app.extensions["quiz_sessions"]
+        session = sessions.get(session_id)
+        if session is None:
+            abort(404)
+        # an adaptive quiz is told whether the last question was answered right
+        body = request.get_json(silent=True)
+        correct = body.get("correct") if isinstance(body, dict) else None
+        if correct is not None and not isinstance(correct, bool):
+            abort(400)
+        if session.adaptive and correct is not None:
+            session.difficulty = adapt_difficulty(session.difficulty, correct)
+        try:
+            question = sampler.next_question(
+                session.category, session.seen, session.difficulty
+            )
+            if question is not None:
+                session.seen.add(question.id)
+            sessions.save(session)
+            return jsonify(
+                {
+                    "success": True,
+                    "session_id": session.id,
+                    "question": question.format() if question else None,
+                    "questions_seen": len(session.seen),
+                    "difficulty": session.difficulty,
+                }
+            )
+        except Exception as e:
+            print(e)
+            abort(500)
+
+    # an endpoint to end a quiz session
+    @app.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+    def end_quiz_session(session_id):
+        sessions = app.extensions["quiz_sessions"]
+        if sessions.get(session_id) is None:
+            abort(404)
+        sessions.delete(session_id)
+        return jsonify({"success": True, "session_id": session_id})
+
+    # an endpoint to report connection pool usage, for sizing the pool per worker
+    @app.route("/metrics/pool", methods=["GET"])
+    def get_pool_metrics():
+        router = app.extensions["replica_router"]
+        return jsonify(
+            {
+                "success": True,
+                "pool": pool_status(),
+                "replicas": router.status() if router else {},
+            }
+        )
+
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
@@ -232,6 +463,15 @@ def create_app(test_config=None):
             400,
         )
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify(
+            {"success": False, "error": 429, "message": "Too Many Requests"}
+        )
+        if getattr(error, "retry_after", None):
+            response.headers["Retry-After"] = str(error.retry_after)
+        return response, 429
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return (
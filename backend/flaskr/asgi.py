@@ -0,0 +1,271 @@
+"""
+ASGI serving mode
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+The quiz endpoints, which carry most of the concurrent traffic, are served
+natively on the event loop with SQLAlchemy's asyncio extension (asyncpg for
+Postgres, aiosqlite for SQLite). Every other request is handed to the Flask
+app through asgiref's WSGI adapter, so all the routes and the error JSON stay
+the same. Both sides share the Flask app's quiz sampler and session store.
+
+An in-memory SQLite database cannot be served this way: the async engine
+would open a second, empty database.
+"""
+import asyncio
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from models import Question, is_memory_database
+from . import create_app
+from .cache import DATA_SIGNATURE, signature_from_row
+from .ratelimit import retry_after, take_token
+from .sampling import adapt_difficulty, parse_difficulty
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+ERROR_MESSAGES = {
+    400: "Bad Request",
+    404: "Not found",
+    422: "Unprocessable Content",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"Content-Type, Authorization"),
+]
+
+
+def async_database_url(database_path):
+    if is_memory_database(database_path):
+        raise ValueError("in-memory SQLite databases are not shared with async engines")
+    scheme, separator, rest = database_path.partition("://")
+    driver = ASYNC_DRIVERS.get(scheme.split("+")[0])
+    if driver is None:
+        raise ValueError("no async driver known for {}".format(scheme))
+    return driver + separator + rest
+
+
+"""
+ThreadedWsgiToAsgi
+    asgiref's WSGI adapter, but running each request in the event loop's
+    thread pool; the stock adapter runs every WSGI request on one shared
+    thread (thread_sensitive=True), so slow routes would queue behind each
+    other
+
+"""
+
+
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False
+    )
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+def error(status):
+    return status, {"success": False, "error": status, "message": ERROR_MESSAGES[status]}
+
+
+"""
+TriviaASGI
+    ASGI application serving the quiz endpoints natively and the rest of the
+    API through the Flask app
+
+"""
+
+
+class TriviaASGI:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = ThreadedWsgiToAsgi(flask_app)
+        self.engine = create_async_engine(
+            async_database_url(flask_app.config["SQLALCHEMY_DATABASE_URI"]),
+            pool_pre_ping=True,
+        )
+        self.sampler = flask_app.extensions["question_sampler"]
+        self.watch = flask_app.extensions["question_watch"]
+        # created on first use, inside the server's event loop
+        self._load_lock = None
+        # (pattern, Flask rule for the rate limiter, handler)
+        self.routes = [
+            (re.compile(r"^/quizzes$"), "/quizzes", self.get_questions_for_quizz),
+            (
+                re.compile(r"^/quizzes/sessions/(?P<session_id>[^/]+)/next$"),
+                "/quizzes/sessions/<session_id>/next",
+                self.get_next_session_question,
+            ),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "POST":
+            for pattern, rule, handler in self.routes:
+                match = pattern.match(scope["path"])
+                if match:
+                    await self.dispatch(
+                        handler, rule, match.groupdict(), scope, receive, send
+                    )
+                    return
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, handler, rule, params, scope, receive, send):
+        headers = []
+        # the same buckets as the Flask routes' before_request limiter
+        client = scope.get("client")
+        wait = take_token(self.flask_app, client[0] if client else None, "POST", rule)
+        if wait:
+            status, payload = error(429)
+            headers.append((b"retry-after", str(retry_after(wait)).encode()))
+        else:
+            try:
+                body = await self.read_json(receive)
+                status, payload = await handler(body, **params)
+            except ValueError:
+                status, payload = error(400)
+            except Exception as e:
+                print(e)
+                status, payload = error(500)
+
+        data = (json.dumps(payload, sort_keys=True) + "\n").encode()
+        headers += [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(data)).encode()),
+        ] + CORS_HEADERS
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": data})
+
+    async def read_json(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        data = b"".join(chunks)
+        return json.loads(data) if data else None
+
+    @property
+    def load_lock(self):
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        return self._load_lock
+
+    async def sampler_rows(self, after=0):
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                select(*self.sampler.COLUMNS)
+                .where(Question.id > after)
+                .order_by(Question.id)
+            )
+            return result.all()
+
+    async def ensure_sampler_loaded(self):
+        """Async twin of QuestionMirror.ensure_loaded for the quiz sampler."""
+        sampler, watch = self.sampler, self.watch
+        if not sampler.loaded:
+            async with self.load_lock:
+                if not sampler.loaded:
+                    rows = await self.sampler_rows()
+                    # building the buckets takes a while on large banks
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, sampler.load, rows
+                    )
+            return
+        if watch.due():
+            async with self.engine.connect() as connection:
+                row = (await connection.execute(DATA_SIGNATURE)).one()
+            watch.update(signature_from_row(row))
+        signature = watch.latest
+        if signature is not None and signature.questions[1] > sampler.max_id:
+            async with self.load_lock:
+                if signature.questions[1] > sampler.max_id:
+                    sampler.extend(await self.sampler_rows(sampler.max_id))
+        if sampler.expired():
+            sampler.rebuild_in_background(self.flask_app)
+
+    async def next_question(self, category, previous_questions, difficulty=None):
+        """Async twin of QuestionSampler.next_question, returning a formatted question."""
+        await self.ensure_sampler_loaded()
+        while True:
+            question_id = self.sampler.pick_loaded(
+                category, previous_questions, difficulty
+            )
+            if question_id is None:
+                return None
+            async with self.engine.connect() as connection:
+                result = await connection.execute(
+                    select(Question.__table__).where(Question.id == question_id)
+                )
+                row = result.mappings().first()
+            if row is not None:
+                return dict(row)
+            self.sampler.remove(question_id)
+
+    async def get_questions_for_quizz(self, body):
+        if (
+            not isinstance(body, dict)
+            or "quiz_category" not in body
+            or "previous_questions" not in body
+        ):
+            return error(400)
+        question = await self.next_question(
+            body.get("quiz_category"),
+            body.get("previous_questions", []),
+            parse_difficulty(body.get("difficulty")),
+        )
+        if question is None:
+            # same as the WSGI route when every question was asked
+            return error(500)
+        return 200, {"success": True, "question": question}
+
+    async def get_next_session_question(self, body, session_id):
+        sessions = self.flask_app.extensions["quiz_sessions"]
+        session = sessions.get(session_id)
+        if session is None:
+            return error(404)
+        correct = body.get("correct") if isinstance(body, dict) else None
+        if correct is not None and not isinstance(correct, bool):
+            return error(400)
+        if session.adaptive and correct is not None:
+            session.difficulty = adapt_difficulty(session.difficulty, correct)
+        question = await self.next_question(
+            session.category, session.seen, session.difficulty
+        )
+        if question is not None:
+            session.seen.add(question["id"])
+        sessions.save(session)
+        return 200, {
+            "success": True,
+            "session_id": session.id,
+            "question": question,
+            "questions_seen": len(session.seen),
+            "difficulty": session.difficulty,
+        }
+
+
+def create_asgi_app(flask_app=None):
+    return TriviaASGI(flask_app or create_app())
@@ -0,0 +1,323 @@
+import threading
+import time
+import weakref
+from collections import namedtuple
+
+from flask import current_app, json
+from sqlalchemy import event, func, select
+
+from models import db, Category, Question
+
+# seconds before categories are re-read, so writes from other workers show up
+DEFAULT_CATEGORY_TTL = 60
+# seconds before maintained question counts are re-counted
+DEFAULT_COUNT_TTL = 30
+# seconds between the question_signature() reads of a worker
+DEFAULT_CHECK_INTERVAL = 1.0
+# rows fetched per round trip when loading the in-memory copies
+LOAD_BATCH_SIZE = 10000
+
+# counts and highest ids of the questions and categories; any insert or
+# delete by another worker changes one of them, so the in-memory copies and
+# the ETags of every worker are derived from it
+DATA_SIGNATURE = select(
+    select(func.count(Question.id)).scalar_subquery(),
+    select(func.max(Question.id)).scalar_subquery(),
+    select(func.count(Category.id)).scalar_subquery(),
+    select(func.max(Category.id)).scalar_subquery(),
+)
+
+# (count, highest id) of each table
+DataSignature = namedtuple("DataSignature", ["questions", "categories"])
+
+CachedCategories = namedtuple(
+    "CachedCategories", ["version", "categories", "body", "loaded_at"]
+)
+
+# every live cache, invalidated by the Category mapper events below
+_category_caches = weakref.WeakSet()
+
+
+def _invalidate_category_caches(*args):
+    for cache in list(_category_caches):
+        cache.invalidate()
+
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(Category, _event_name, _invalidate_category_caches)
+
+
+"""
+CategoryCache
+    memoizes the {id: type} category map and the serialized /categories
+    body; `version` is bumped every time the cache is invalidated
+
+"""
+
+
+class CategoryCache:
+    def __init__(self, ttl=DEFAULT_CATEGORY_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.Lock()
+        self._entry = None
+        _category_caches.add(self)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entry = None
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.monotonic() - entry.loaded_at >= self.ttl
+
+    def get(self):
+        entry = self._entry
+        if entry is not None and not self._expired(entry):
+            return entry
+
+        version = self.version
+        categories = {
+            category_id: category_type
+            for category_id, category_type in db.session.query(
+                Category.id, Category.type
+            ).order_by(Category.id)
+        }
+        body = (json.dumps({"success": True, "categories": categories}) + "\n").encode()
+        entry = CachedCategories(
+            version=version,
+            categories=categories,
+            body=body,
+            loaded_at=time.monotonic(),
+        )
+        with self._lock:
+            # an invalidation raced with the query; serve it but do not keep it
+            if self.version == version:
+                self._entry = entry
+        return entry
+
+    def categories(self):
+        return self.get().categories
+
+
+"""
+QuestionCounter
+    question totals (overall and per category) kept up to date on insert and
+    delete, so list endpoints do not issue a COUNT(*) per request
+
+"""
+
+
+class QuestionCounter:
+    def __init__(self, ttl=DEFAULT_COUNT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # category key (None for all questions) -> (count, loaded at)
+        self._counts = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = {}
+
+    def count(self, category=None):
+        key = None if category is None else str(category)
+        entry = self._counts.get(key)
+        if entry is not None and (
+            self.ttl is None or time.monotonic() - entry[1] < self.ttl
+        ):
+            return entry[0]
+
+        query = db.session.query(func.count(Question.id))
+        if key is not None:
+            query = query.filter(Question.category == int(key))
+        total = query.scalar()
+        with self._lock:
+            self._counts[key] = (total, time.monotonic())
+        return total
+
+    def _adjust(self, category, delta):
+        keys = [None] if category is None else [None, str(category)]
+        with self._lock:
+            for key in keys:
+                entry = self._counts.get(key)
+                if entry is not None:
+                    self._counts[key] = (max(entry[0] + delta, 0), entry[1])
+
+    def add(self, category, count=1):
+        self._adjust(category, count)
+
+    def remove(self, category, count=1):
+        self._adjust(category, -count)
+
+
+def signature_from_row(row):
+    questions, max_question_id, categories, max_category_id = row
+    return DataSignature(
+        (questions, max_question_id or 0), (categories, max_category_id or 0)
+    )
+
+
+def data_signature():
+    """The DataSignature of the database."""
+    return signature_from_row(db.session.execute(DATA_SIGNATURE).one())
+
+
+"""
+QuestionWatch
+    reads the data_signature() at most once per `interval` seconds for the
+    in-memory copies of the questions and the ETags of a worker; while one
+    thread reads it, the others go on with the previous value
+
+"""
+
+
+class QuestionWatch:
+    def __init__(self, interval=DEFAULT_CHECK_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = None
+
+    def invalidate(self):
+        self._signature = None
+        self._checked_at = None
+
+    def expire(self):
+        """Read the signature again on next use, keeping the old one meanwhile."""
+        self._checked_at = None
+
+    def due(self):
+        # with no interval it is only read again after expire()
+        return self._checked_at is None or (
+            self.interval is not None
+            and time.monotonic() - self._checked_at >= self.interval
+        )
+
+    @property
+    def latest(self):
+        """The last signature read, without reading it again."""
+        return self._signature
+
+    def update(self, signature):
+        self._signature = signature
+        self._checked_at = time.monotonic()
+
+    def signature(self):
+        """The latest DataSignature."""
+        # only the first read waits for a concurrent one
+        if self.due() and self._lock.acquire(blocking=self._signature is None):
+            try:
+                if self.due():
+                    self.update(data_signature())
+            finally:
+                self._lock.release()
+        return self._signature
+
+
+"""
+QuestionMirror
+    base of the in-memory copies of the questions table: loaded in full on
+    first use, then kept current by pulling the rows other workers inserted
+    (ids above the highest one held) and rebuilt in a background thread when
+    they expire or drift, while the old copy keeps serving
+
+"""
+
+
+class QuestionMirror:
+    # the Question columns of the rows given to load() and extend()
+    COLUMNS = ()
+
+    def __init__(self, refresh_interval=None, watch=None):
+        # seconds after which the copy is rebuilt anyway
+        self.refresh_interval = refresh_interval
+        self.watch = watch
+        self._lock = threading.RLock()
+        # serializes the loads and pulls made on request threads
+        self._load_lock = threading.Lock()
+        self._rebuilding = False
+        self._max_id = 0
+        self._loaded_at = None
+
+    @property
+    def loaded(self):
+        raise NotImplementedError
+
+    @property
+    def max_id(self):
+        return self._max_id
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def load(self, rows):
+        """Replace the copy with `rows`, building it before taking the lock."""
+        raise NotImplementedError
+
+    def extend(self, rows):
+        """Add `rows`, inserted since the copy was loaded."""
+        raise NotImplementedError
+
+    def drifted(self, count):
+        """Whether a copy holding every id up to the database's highest one,
+        and `count` rows in the database, needs a rebuild (e.g. after deletes
+        by other workers)."""
+        return False
+
+    def rows(self, after=0):
+        return (
+            db.session.query(*self.COLUMNS)
+            .filter(Question.id > after)
+            .order_by(Question.id)
+            .yield_per(LOAD_BATCH_SIZE)
+        )
+
+    def refresh(self):
+        self.load(self.rows())
+
+    def expired(self):
+        return (
+            self.refresh_interval is not None
+            and self._loaded_at is not None
+            and time.monotonic() - self._loaded_at > self.refresh_interval
+        )
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            # concurrent first requests wait for a single load
+            with self._load_lock:
+                if not self.loaded:
+                    self.refresh()
+            return
+        if self.watch is not None:
+            count, max_id = self.watch.signature().questions
+            if max_id > self._max_id:
+                with self._load_lock:
+                    if max_id > self._max_id:
+                        self.extend(self.rows(self._max_id))
+            # rows pulled past the signature would be counted twice
+            if self._max_id == max_id and self.drifted(count):
+                self.rebuild_in_background()
+        if self.expired():
+            self.rebuild_in_background()
+
+    def rebuild_in_background(self, app=None):
+        """Rebuild the copy in a thread, unless a rebuild is running already."""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        app = app or current_app._get_current_object()
+        threading.Thread(target=self._rebuild, args=(app,), daemon=True).start()
+
+    def _rebuild(self, app):
+        try:
+            with app.app_context():
+                try:
+                    self.refresh()
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(e)
+        finally:
+            self._rebuilding = False
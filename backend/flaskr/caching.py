@@ -0,0 +1,110 @@
+import functools
+import weakref
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from models import Category, Question
+from .cache import QuestionWatch
+
+NO_STORE = "no-store"
+
+# every live DataVersion, bumped by the mapper events below
+_data_versions = weakref.WeakSet()
+
+
+def _bump(*names):
+    def listener(*args):
+        for versions in list(_data_versions):
+            versions.bump(*names)
+
+    return listener
+
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(Question, _event_name, _bump("questions"))
+    # question lists carry the category map too
+    event.listen(Category, _event_name, _bump("categories", "questions"))
+
+
+"""
+DataVersion
+    strong ETags derived from the counts and highest ids of the tables, read
+    through the worker's QuestionWatch, so every worker gives the same data
+    the same ETag without reading or hashing the response body
+
+"""
+
+
+class DataVersion:
+    def __init__(self, watch):
+        self.watch = watch
+        _data_versions.add(self)
+
+    def bump(self, *names):
+        """Have the next ETag show a write made through this worker."""
+        self.watch.expire()
+
+    def etag(self, name):
+        signature = self.watch.signature()
+        if name == "categories":
+            parts = signature.categories
+        else:
+            # question lists carry the category map too
+            parts = signature.questions + signature.categories
+        return "{}-{}".format(name, "-".join(str(part) for part in parts))
+
+
+def matching_etag(etag):
+    """The form of `etag` the client sent in If-None-Match, if any.
+
+    Compressed responses carry the ETag with a "-gzip" or "-br" suffix.
+    """
+    for candidate in (etag, etag + "-gzip", etag + "-br"):
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def cache_control(value, etag=None):
+    """Send `value` as the Cache-Control header of the view's responses.
+
+    `etag` names a DataVersion table; a request whose If-None-Match holds the
+    current ETag gets a 304 before the view runs, so no query is made.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = None
+            if etag is not None:
+                tag = current_app.extensions["data_version"].etag(etag)
+                matched = matching_etag(tag)
+                if matched is not None:
+                    response = current_app.response_class(status=304)
+                    response.set_etag(matched)
+                    response.headers["Cache-Control"] = value
+                    return response
+            response = current_app.make_response(view(*args, **kwargs))
+            if tag is not None and response.status_code == 200:
+                response.set_etag(tag)
+            response.headers["Cache-Control"] = value
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def init_caching(app, watch=None):
+    """Keep a DataVersion for `app` and mark uncached responses as no-store.
+
+    The ETags follow `watch`, the app's QuestionWatch if it has one.
+    """
+    watch = watch or app.extensions.get("question_watch") or QuestionWatch()
+    app.extensions["data_version"] = DataVersion(watch)
+
+    @app.after_request
+    def default_cache_control(response):
+        response.headers.setdefault("Cache-Control", NO_STORE)
+        return response
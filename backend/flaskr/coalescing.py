@@ -0,0 +1,159 @@
+import functools
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, request
+
+# seconds a read result is reused for identical requests
+DEFAULT_RESULT_TTL = 1.0
+DEFAULT_MAX_RESULTS = 1024
+# seconds a follower waits for the leader before running the view itself
+FOLLOWER_TIMEOUT = 10.0
+
+CachedResult = namedtuple("CachedResult", ["body", "status", "headers", "expires_at"])
+
+
+"""
+ResultCache
+    short-lived LRU cache of finished read responses, keyed by request
+
+"""
+
+
+class ResultCache:
+    def __init__(self, ttl=DEFAULT_RESULT_TTL, max_size=DEFAULT_MAX_RESULTS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                return None
+            if result.expires_at <= time.monotonic():
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            return result
+
+    def put(self, key, body, status, headers):
+        result = CachedResult(body, status, headers, time.monotonic() + self.ttl)
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results = OrderedDict()
+
+
+class _Flight:
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+"""
+SingleFlight
+    runs one call per key at a time; concurrent callers with the same key
+    wait for it and share its result, which the ResultCache then keeps
+    serving for its TTL
+
+"""
+
+
+class SingleFlight:
+    def __init__(self, cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        # key -> the _Flight of the call running for it
+        self._flights = {}
+
+    def do(self, key, call):
+        """Return a CachedResult for `key`, running `call` only if no one else is.
+
+        `call()` returns a CachedResult to share, or any other value when its
+        result must not be shared; that value is returned as is, and waiting
+        callers run `call` themselves.
+        """
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(FOLLOWER_TIMEOUT) and isinstance(
+                flight.result, CachedResult
+            ):
+                return flight.result
+            # the leader failed, is stuck or had nothing to share
+            return call()
+
+        try:
+            flight.result = self.cache.get(key) or call()
+            return flight.result
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+def coalesced(version=None):
+    """Share the response of a read view between identical concurrent requests.
+
+    Requests are identical when they have the same method, path, query string
+    and body. Only complete 200 responses are shared, for the ResultCache TTL;
+    `version` names a DataVersion table whose changes start a new key, so this
+    worker's writes are seen at once.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            flights = current_app.extensions.get("single_flight")
+            if flights is None:
+                return view(*args, **kwargs)
+            key = (request.method, request.full_path, request.get_data())
+            if version is not None:
+                key += (current_app.extensions["data_version"].etag(version),)
+
+            def call():
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                return flights.cache.put(
+                    key,
+                    response.get_data(),
+                    response.status_code,
+                    list(response.headers.items()),
+                )
+
+            result = flights.do(key, call)
+            if not isinstance(result, CachedResult):
+                return result
+            return current_app.response_class(
+                result.body, status=result.status, headers=result.headers
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def init_coalescing(app, ttl=DEFAULT_RESULT_TTL, max_size=DEFAULT_MAX_RESULTS):
+    app.extensions["single_flight"] = SingleFlight(ResultCache(ttl, max_size))
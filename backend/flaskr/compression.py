@@ -0,0 +1,81 @@
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip is offered
+    brotli = None
+
+# bodies smaller than this are sent as they are; compressing them costs more
+# CPU than the bytes it saves
+DEFAULT_MIN_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = frozenset(
+    ("application/json", "application/x-ndjson", "text/plain", "text/html")
+)
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        # flush each chunk so the client sees rows as they are produced
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def negotiate(accept_encodings, streamed=False):
+    """The content coding to use for a request's Accept-Encoding, or None."""
+    offered = ["br", "gzip"] if brotli is not None and not streamed else ["gzip"]
+    coding = accept_encodings.best_match(offered)
+    return coding if coding in offered else None
+
+
+def init_compression(app, min_size=DEFAULT_MIN_SIZE):
+    """Compress JSON and text responses of `app` with brotli or gzip.
+
+    The coding follows the request's Accept-Encoding. Buffered bodies below
+    `min_size` bytes are left alone; streamed bodies are gzipped chunk by
+    chunk. A strong ETag gets the coding appended, since the compressed bytes
+    are a different representation.
+    """
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or "Content-Encoding" in response.headers
+            or request.method == "HEAD"
+        ):
+            return response
+        coding = negotiate(request.accept_encodings, response.is_streamed)
+        if coding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _gzip_stream(response.response, GZIP_LEVEL)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            if coding == "br":
+                response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+            else:
+                response.set_data(gzip.compress(data, GZIP_LEVEL, mtime=0))
+
+        response.headers["Content-Encoding"] = coding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag("{}-{}".format(etag, coding))
+        return response
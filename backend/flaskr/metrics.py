@@ -0,0 +1,210 @@
+import bisect
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import pool_status
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+
+"""
+Histogram
+    cumulative Prometheus-style histogram with fixed buckets
+
+"""
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield "{}_bucket{{{},le=\"{}\"}} {}".format(name, labels, bound, cumulative)
+        yield "{}_sum{{{}}} {}".format(name, labels, self.sum)
+        yield "{}_count{{{}}} {}".format(name, labels, self.count)
+
+
+"""
+RequestStats
+    what one request spent, collected while it runs
+
+"""
+
+
+class RequestStats:
+    __slots__ = ("started", "sql_durations", "sql_statements")
+
+    def __init__(self, capture_sql):
+        self.started = time.perf_counter()
+        self.sql_durations = []
+        # statement texts, only kept for the slow request log
+        self.sql_statements = [] if capture_sql else None
+
+
+"""
+Metrics
+    per-route latency, SQL statement and response size histograms,
+    rendered in the Prometheus text format
+
+"""
+
+
+class Metrics:
+    HISTOGRAMS = (
+        ("trivia_request_duration_seconds", "Request latency in seconds.", LATENCY_BUCKETS),
+        ("trivia_request_sql_statements", "SQL statements issued per request.", STATEMENT_BUCKETS),
+        ("trivia_sql_duration_seconds", "Duration of each SQL statement in seconds.", LATENCY_BUCKETS),
+        ("trivia_response_size_bytes", "Response body size in bytes.", SIZE_BUCKETS),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (route, method, status) -> count
+        self.requests = {}
+        # metric name -> {(route, method): Histogram}
+        self.histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+
+    def _observe(self, name, key, value):
+        histograms = self.histograms[name]
+        histogram = histograms.get(key)
+        if histogram is None:
+            buckets = next(b for n, _, b in self.HISTOGRAMS if n == name)
+            histogram = histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def record(self, route, method, status, seconds, stats, size):
+        key = (route, method)
+        with self._lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            self._observe("trivia_request_duration_seconds", key, seconds)
+            self._observe("trivia_request_sql_statements", key, len(stats.sql_durations))
+            for duration in stats.sql_durations:
+                self._observe("trivia_sql_duration_seconds", key, duration)
+            if size is not None:
+                self._observe("trivia_response_size_bytes", key, size)
+
+    def render(self):
+        lines = [
+            "# HELP trivia_requests_total Requests served.",
+            "# TYPE trivia_requests_total counter",
+        ]
+        with self._lock:
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    'trivia_requests_total{{route="{}",method="{}",status="{}"}} {}'.format(
+                        route, method, status, count
+                    )
+                )
+            for name, help_text, _ in self.HISTOGRAMS:
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} histogram".format(name))
+                for (route, method), histogram in sorted(self.histograms[name].items()):
+                    labels = 'route="{}",method="{}"'.format(route, method)
+                    lines.extend(histogram.samples(name, labels))
+        for key, value in pool_status().items():
+            if isinstance(value, (int, float)):
+                lines.append("# TYPE trivia_db_pool_{} gauge".format(key))
+                lines.append("trivia_db_pool_{} {}".format(key, value))
+        return "\n".join(lines) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and "request_stats" in g:
+        # kept on the statement's own context, so a statement that fails
+        # leaves nothing behind on the pooled connection
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None or not has_request_context() or "request_stats" not in g:
+        return
+    stats = g.request_stats
+    stats.sql_durations.append(time.perf_counter() - started)
+    if stats.sql_statements is not None:
+        stats.sql_statements.append(statement)
+
+
+_engine_events_installed = False
+
+
+def init_metrics(app, slow_request_seconds=None):
+    """Collect request metrics for `app` and serve them on GET /metrics.
+
+    Nothing is registered unless this is called, so a disabled app pays no cost.
+    Requests slower than `slow_request_seconds` are logged with their SQL.
+    """
+    global _engine_events_installed
+    if not _engine_events_installed:
+        # every engine (primary and replicas); a no-op outside instrumented requests
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _engine_events_installed = True
+
+    metrics = Metrics()
+    app.extensions["metrics"] = metrics
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats(capture_sql=slow_request_seconds is not None)
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = g.pop("request_stats", None)
+        if stats is None:
+            return response
+        seconds = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        size = None if response.is_streamed else response.calculate_content_length()
+        metrics.record(
+            route,
+            request.method,
+            response.status_code,
+            seconds,
+            stats,
+            size,
+        )
+        if slow_request_seconds is not None and seconds >= slow_request_seconds:
+            app.logger.warning(
+                "slow request %s %s took %.1f ms with %d SQL statements (%.1f ms)\n%s",
+                request.method,
+                request.full_path,
+                seconds * 1e3,
+                len(stats.sql_durations),
+                sum(stats.sql_durations) * 1e3,
+                "\n".join(
+                    "  {:.1f} ms  {}".format(duration * 1e3, statement)
+                    for duration, statement in zip(
+                        stats.sql_durations, stats.sql_statements
+                    )
+                ),
+            )
+        return response
+
+    # an endpoint to expose the request metrics in the Prometheus text format
+    @app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return app.response_class(
+            metrics.render(), mimetype="text/plain; version=0.0.4"
+        )
+
+    return metrics
@@ -0,0 +1,46 @@
+import bisect
+
+from flask import abort, request
+
+from models import Question
+
+
+def page_args(default_limit, max_limit):
+    """Read `page`, `after` and `limit` from the query string.
+
+    `after` switches to keyset pagination: the page starts right after the
+    question with that id, so deep pages cost the same as the first one.
+    """
+    page = request.args.get("page", 1, type=int)
+    after = request.args.get("after", None, type=int)
+    limit = request.args.get("limit", default_limit, type=int)
+    if page < 1 or limit < 1 or (after is not None and after < 0):
+        abort(400)
+    return page, after, min(limit, max_limit)
+
+
+def paginate(query, page, after, limit):
+    """Return one page of a question query and the `after` cursor of the next page.
+
+    The cursor is None on the last page. One extra row is read to find out
+    whether there is a next page, so no COUNT(*) is needed.
+    """
+    query = query.order_by(Question.id)
+    if after is not None:
+        query = query.filter(Question.id > after)
+    else:
+        query = query.offset((page - 1) * limit)
+    items = query.limit(limit + 1).all()
+    next_after = items[limit - 1].id if len(items) > limit else None
+    return items[:limit], next_after
+
+
+def paginate_ids(ids, page, after, limit):
+    """Like `paginate`, for an ascending list of question ids held in memory."""
+    if after is not None:
+        start = bisect.bisect_right(ids, after)
+    else:
+        start = (page - 1) * limit
+    page_ids = ids[start : start + limit]
+    next_after = page_ids[-1] if start + limit < len(ids) else None
+    return page_ids, next_after
@@ -0,0 +1,99 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+DEFAULT_MAX_CLIENTS = 100000
+
+
+"""
+RateLimitStore
+    interface of the token bucket storage backends; subclass it and set
+    app.extensions["rate_limit_store"] to share the buckets between workers
+    (e.g. in redis, where take() can be one Lua script)
+
+"""
+
+
+class RateLimitStore:
+    def take(self, key, rate, burst, now):
+        """Take one token from the bucket of `key`.
+
+        The bucket holds at most `burst` tokens and refills at `rate` tokens
+        per second. Returns 0 when a token was taken, otherwise the seconds
+        until one is available.
+        """
+        raise NotImplementedError
+
+
+"""
+MemoryRateLimitStore
+    in-process token buckets, the least recently used dropped past
+    `max_clients`
+
+"""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    def __init__(self, max_clients=DEFAULT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # key -> (tokens, updated at)
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+def take_token(app, remote_addr, method, rule):
+    """Seconds until `remote_addr` may call `rule` again; 0 if it may now."""
+    limit = app.extensions.get("rate_limit")
+    if limit is None:
+        return 0
+    key = "{}|{}|{}".format(remote_addr, method, rule)
+    return app.extensions["rate_limit_store"].take(key, *limit, time.time())
+
+
+def retry_after(wait):
+    """The Retry-After value, in whole seconds, for a take_token() wait."""
+    return max(math.ceil(wait), 1)
+
+
+def init_rate_limit(app, rate, burst=None, store=None):
+    """Limit each client IP to `rate` requests per second on each route.
+
+    Bursts of up to `burst` requests (default: one second's worth) are let
+    through; beyond that requests get a 429 with a Retry-After header.
+    """
+    app.extensions["rate_limit"] = (rate, burst or max(rate, 1))
+    app.extensions["rate_limit_store"] = (
+        store if store is not None else MemoryRateLimitStore()
+    )
+
+    @app.before_request
+    def limit_request_rate():
+        # preflights and unknown paths do not reach the database
+        if request.method == "OPTIONS" or request.url_rule is None:
+            return None
+        wait = take_token(app, request.remote_addr, request.method, request.url_rule.rule)
+        if wait:
+            raise TooManyRequests(retry_after=retry_after(wait))
+        return None
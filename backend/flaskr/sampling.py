@@ -0,0 +1,324 @@
+import bisect
+import itertools
+import random
+import time
+from models import Question
+from .cache import QuestionMirror
+
+# quiz_category value the frontend sends for "ALL"
+ALL_CATEGORIES = 0
+
+# random probes to try before switching to exact offset sampling
+MAX_REJECTIONS = 16
+
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+# relative weight of a question per difficulty level away from the target
+DIFFICULTY_FALLOFF = 0.25
+# where an adaptive quiz starts, and how far it moves after each answer
+ADAPTIVE_START = 3
+ADAPTIVE_STEP = 0.5
+
+# seconds after which the ids are rebuilt even if no change was seen
+DEFAULT_REFRESH_INTERVAL = 300
+
+
+def category_key(category):
+    """Normalize a quiz category (id, numeric string or {"id": ...}) to a bucket key."""
+    if isinstance(category, dict):
+        category = category.get("id")
+    if category is None:
+        return None
+    return str(category)
+
+
+def parse_difficulty(value):
+    """Validate a requested target difficulty; None means any difficulty."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("difficulty must be a number")
+    if not MIN_DIFFICULTY <= value <= MAX_DIFFICULTY:
+        raise ValueError(
+            "difficulty must be between {} and {}".format(MIN_DIFFICULTY, MAX_DIFFICULTY)
+        )
+    return value
+
+
+def adapt_difficulty(target, correct):
+    """The next target of an adaptive quiz: harder after a right answer."""
+    step = ADAPTIVE_STEP if correct else -ADAPTIVE_STEP
+    return min(max(target + step, MIN_DIFFICULTY), MAX_DIFFICULTY)
+
+
+def difficulty_weight(difficulty, target):
+    if difficulty is None:
+        # unrated questions count as far from any target
+        return DIFFICULTY_FALLOFF ** (MAX_DIFFICULTY - MIN_DIFFICULTY)
+    return DIFFICULTY_FALLOFF ** abs(difficulty - target)
+
+
+"""
+IdBucket
+    an unordered set of question ids with O(1) add, remove and random choice
+
+"""
+
+
+class IdBucket:
+    __slots__ = ("ids", "positions")
+
+    def __init__(self, ids=()):
+        self.ids = []
+        self.positions = {}
+        for question_id in ids:
+            self.add(question_id)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        return question_id in self.positions
+
+    def add(self, question_id):
+        if question_id in self.positions:
+            return
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if position < len(self.ids):
+            # move the last id into the hole so the array stays dense
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def choice(self, excluded=(), rng=random):
+        """Return a random id not in `excluded`, or None if every id is excluded.
+
+        Rejection sampling is used while the excluded ids are a small part of
+        the bucket; otherwise the positions of the excluded ids are skipped over
+        a random offset, which costs O(m log m) in the number of excluded ids
+        and never depends on the size of the bucket.
+        """
+        size = len(self.ids)
+        if size == 0:
+            return None
+
+        if len(excluded) * 2 < size:
+            for _ in range(MAX_REJECTIONS):
+                candidate = self.ids[rng.randrange(size)]
+                if candidate not in excluded:
+                    return candidate
+
+        skipped = sorted(
+            self.positions[question_id]
+            for question_id in excluded
+            if question_id in self.positions
+        )
+        free = size - len(skipped)
+        if free <= 0:
+            return None
+        offset = rng.randrange(free)
+        for position in skipped:
+            if position > offset:
+                break
+            offset += 1
+        return self.ids[offset]
+
+
+"""
+QuestionSampler
+    keeps a per-category array of question ids in memory so that quiz questions
+    can be picked without loading the candidate rows from the database; the ids
+    are also split by difficulty for picks around a target difficulty
+
+"""
+
+
+class QuestionSampler(QuestionMirror):
+    COLUMNS = (Question.id, Question.category, Question.difficulty)
+
+    # the attributes replaced by load()
+    _STATE = (
+        "_all",
+        "_buckets",
+        "_categories",
+        "_all_levels",
+        "_levels",
+        "_difficulties",
+        "_max_id",
+    )
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL, watch=None, rng=None):
+        super().__init__(refresh_interval, watch)
+        self.rng = rng or random.Random()
+        self._all = None
+        self._buckets = {}
+        self._categories = {}
+        # difficulty -> bucket, over all categories and per category key
+        self._all_levels = {}
+        self._levels = {}
+        self._difficulties = {}
+
+    @property
+    def loaded(self):
+        return self._all is not None
+
+    def __len__(self):
+        return len(self._all) if self._all is not None else 0
+
+    def load(self, rows):
+        """Replace the buckets with `(id, category[, difficulty])` rows.
+
+        The new buckets are built without the lock, which is only taken to
+        swap them in, so picks go on from the old ones meanwhile. Rows added
+        during the build are pulled again by id.
+        """
+        fresh = QuestionSampler(None, None, self.rng)
+        fresh._all = IdBucket()
+        for row in rows:
+            fresh._insert(*row)
+        with self._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(fresh, name))
+            self._loaded_at = time.monotonic()
+
+    def extend(self, rows):
+        rows = list(rows)
+        with self._lock:
+            for row in rows:
+                self.add(*row)
+
+    def invalidate(self):
+        with self._lock:
+            self._all = None
+
+    # drifted() stays False: ids deleted by other workers are dropped one by
+    # one when next_question() misses them
+
+    def _insert(self, question_id, category, difficulty=None):
+        key = category_key(category)
+        self._all.add(question_id)
+        self._buckets.setdefault(key, IdBucket()).add(question_id)
+        self._categories[question_id] = key
+        self._all_levels.setdefault(difficulty, IdBucket()).add(question_id)
+        self._levels.setdefault(key, {}).setdefault(difficulty, IdBucket()).add(
+            question_id
+        )
+        self._difficulties[question_id] = difficulty
+        self._max_id = max(self._max_id, question_id)
+
+    def add(self, question_id, category, difficulty=None):
+        with self._lock:
+            if self._all is None:
+                # nothing loaded yet; the next pick reads the new row anyway
+                return
+            self.remove(question_id)
+            self._insert(question_id, category, difficulty)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._all is None:
+                return
+            self._all.remove(question_id)
+            key = self._categories.pop(question_id, None)
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.remove(question_id)
+            difficulty = self._difficulties.pop(question_id, None)
+            for levels in (self._all_levels, self._levels.get(key, {})):
+                bucket = levels.get(difficulty)
+                if bucket is not None:
+                    bucket.remove(question_id)
+
+    def bucket(self, category):
+        self.ensure_loaded()
+        with self._lock:
+            return self._bucket(category)
+
+    def _bucket(self, category):
+        key = category_key(category)
+        if key is None or key == str(ALL_CATEGORIES):
+            return self._all
+        return self._buckets.get(key, IdBucket())
+
+    def levels(self, category):
+        """The {difficulty: bucket} map of `category`."""
+        self.ensure_loaded()
+        with self._lock:
+            return self._level_map(category)
+
+    def _level_map(self, category):
+        key = category_key(category)
+        if key is None or key == str(ALL_CATEGORIES):
+            return self._all_levels
+        return self._levels.get(key, {})
+
+    def _weighted_choice(self, levels, target, excluded):
+        """Pick an id with probability proportional to its difficulty weight.
+
+        A level is drawn from the cumulative weights of the non-empty levels
+        (weight times size, so every question keeps its own weight), then an
+        id is drawn from its bucket. There are at most a handful of levels, so
+        a pick does not depend on the size of the bank.
+        """
+        candidates = [
+            (bucket, difficulty_weight(difficulty, target) * len(bucket))
+            for difficulty, bucket in levels.items()
+            if len(bucket)
+        ]
+        while candidates:
+            cumulative = list(itertools.accumulate(weight for _, weight in candidates))
+            index = bisect.bisect_right(cumulative, self.rng.random() * cumulative[-1])
+            index = min(index, len(candidates) - 1)
+            question_id = candidates[index][0].choice(excluded, self.rng)
+            if question_id is not None:
+                return question_id
+            # every question of this level was asked already
+            del candidates[index]
+        return None
+
+    def pick(self, category, previous_questions=(), difficulty=None):
+        """Return a random unseen question id in `category`, or None.
+
+        With a target `difficulty`, questions near it are favoured: each
+        level away from the target makes a question DIFFICULTY_FALLOFF times
+        as likely.
+        """
+        self.ensure_loaded()
+        return self.pick_loaded(category, previous_questions, difficulty)
+
+    def pick_loaded(self, category, previous_questions=(), difficulty=None):
+        """pick() among the ids already loaded, without reading the database."""
+        if previous_questions is None or isinstance(previous_questions, (list, tuple)):
+            excluded = set(previous_questions or ())
+        else:
+            # already a set-like of ids, e.g. the SeenSet of a quiz session
+            excluded = previous_questions
+        with self._lock:
+            if self._all is None:
+                return None
+            if difficulty is not None:
+                return self._weighted_choice(
+                    self._level_map(category), difficulty, excluded
+                )
+            return self._bucket(category).choice(excluded, self.rng)
+
+    def next_question(self, category, previous_questions=(), difficulty=None):
+        """Return a random unseen Question in `category`, or None.
+
+        Ids that no longer exist in the database (deleted by another worker)
+        are dropped from the buckets and another id is drawn.
+        """
+        while True:
+            question_id = self.pick(category, previous_questions, difficulty)
+            if question_id is None:
+                return None
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question
+            self.remove(question_id)
@@ -0,0 +1,117 @@
+import time
+
+from models import Question
+from .cache import QuestionMirror
+from .sampling import DEFAULT_REFRESH_INTERVAL
+
+# length of the substrings the index is keyed on
+GRAM_SIZE = 3
+
+
+def trigrams(text):
+    return {text[i : i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+"""
+SearchIndex
+    in-memory trigram index of the question texts; a search intersects the
+    posting lists of the term's trigrams and checks the few candidates left,
+    giving the same case-insensitive substring matches as ILIKE '%term%'; like
+    the QuestionSampler it pulls the questions other workers added and is
+    rebuilt in the background, here also when their count no longer matches
+
+"""
+
+
+class SearchIndex(QuestionMirror):
+    COLUMNS = (Question.id, Question.question)
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL, watch=None):
+        super().__init__(refresh_interval, watch)
+        self._texts = None
+        self._postings = {}
+
+    @property
+    def loaded(self):
+        return self._texts is not None
+
+    def __len__(self):
+        return len(self._texts) if self._texts is not None else 0
+
+    def load(self, rows):
+        """Replace the index with `(id, question text)` pairs.
+
+        The new index is built without the lock, so searches go on against
+        the old one until it is swapped in.
+        """
+        fresh = SearchIndex(None)
+        fresh._texts = {}
+        for question_id, text in rows:
+            fresh._insert(question_id, text)
+        with self._lock:
+            self._texts = fresh._texts
+            self._postings = fresh._postings
+            self._max_id = fresh._max_id
+            self._loaded_at = time.monotonic()
+
+    def extend(self, rows):
+        rows = list(rows)
+        with self._lock:
+            for question_id, text in rows:
+                self.add(question_id, text)
+
+    def invalidate(self):
+        with self._lock:
+            self._texts = None
+
+    def drifted(self, count):
+        # deleted by another worker; a deleted id would otherwise keep matching
+        return count != len(self)
+
+    def _insert(self, question_id, text):
+        text = (text or "").lower()
+        self._texts[question_id] = text
+        self._max_id = max(self._max_id, question_id)
+        for gram in trigrams(text):
+            self._postings.setdefault(gram, set()).add(question_id)
+
+    def add(self, question_id, text):
+        with self._lock:
+            if self._texts is None:
+                return
+            self.remove(question_id)
+            self._insert(question_id, text)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self._texts is None:
+                return
+            text = self._texts.pop(question_id, None)
+            if text is None:
+                return
+            for gram in trigrams(text):
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard(question_id)
+                    if not posting:
+                        del self._postings[gram]
+
+    def search(self, term):
+        """Return the ids of the questions containing `term`, in ascending order."""
+        term = term.lower()
+        self.ensure_loaded()
+        with self._lock:
+            grams = trigrams(term)
+            if not grams:
+                # too short to use the index
+                candidates = self._texts.keys()
+            else:
+                postings = sorted(
+                    (self._postings.get(gram, ()) for gram in grams), key=len
+                )
+                candidates = set(postings[0]).intersection(*postings[1:])
+            return sorted(
+                question_id
+                for question_id in candidates
+                if term in self._texts[question_id]
+            )
@@ -0,0 +1,149 @@
+import json
+import threading
+import weakref
+
+from flask import current_app, stream_with_context
+from sqlalchemy import event
+
+from models import db, Question
+
+# rows fetched from the server-side cursor and sent per chunk when streaming
+STREAM_BATCH_SIZE = 1000
+
+QUESTION_COLUMNS = (
+    Question.id,
+    Question.question,
+    Question.answer,
+    Question.category,
+    Question.difficulty,
+)
+
+# every live fragment cache, cleared of changed rows by the mapper events below
+_fragment_caches = weakref.WeakSet()
+
+
+def _discard_question(mapper, connection, target):
+    for cache in list(_fragment_caches):
+        cache.discard(target.id)
+
+
+for _event_name in ("after_update", "after_delete"):
+    event.listen(Question, _event_name, _discard_question)
+
+
+def question_rows():
+    """Query of plain (id, question, answer, category, difficulty) rows.
+
+    Rows skip the ORM identity map and change tracking, which the read-only
+    list endpoints do not need.
+    """
+    return db.session.query(*QUESTION_COLUMNS)
+
+
+# built once; json.dumps with options would build a new encoder per call
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def encode(value):
+    return _encoder.encode(value).encode()
+
+
+def encode_fields(fields):
+    """Encode the closing `,"key":value...}` part of a questions document."""
+    parts = [b"," + encode(key) + b":" + encode(fields[key]) for key in sorted(fields)]
+    return b"".join(parts) + b"}\n"
+
+
+"""
+QuestionFragments
+    memoized JSON encoding of each question row, keyed by id; a fragment is
+    reused only while the row it was built from is unchanged
+
+"""
+
+
+class QuestionFragments:
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # question id -> (row, encoded bytes)
+        self._fragments = {}
+        _fragment_caches.add(self)
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def discard(self, question_id):
+        with self._lock:
+            self._fragments.pop(question_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._fragments = {}
+
+    def fragment(self, row, store=True):
+        row = tuple(row)
+        cached = self._fragments.get(row[0])
+        if cached is not None and cached[0] == row:
+            return cached[1]
+        data = encode(
+            {
+                "id": row[0],
+                "question": row[1],
+                "answer": row[2],
+                "category": row[3],
+                "difficulty": row[4],
+            }
+        )
+        if not store:
+            return data
+        with self._lock:
+            if len(self._fragments) >= self.max_size:
+                self._fragments.pop(next(iter(self._fragments)))
+            self._fragments[row[0]] = (row, data)
+        return data
+
+    def response(self, rows, **fields):
+        """A JSON response with the encoded `rows` as "questions", plus `fields`."""
+        parts = [b'{"questions":[', b",".join(self.fragment(row) for row in rows), b"]"]
+        parts.append(encode_fields(fields))
+        return current_app.response_class(b"".join(parts), mimetype="application/json")
+
+    def stream(self, rows, mode, **fields):
+        """A streamed response of `rows`, read lazily from a server-side cursor.
+
+        `mode` "ndjson" sends one question per line; "json" sends the same
+        document as `response`, in chunks. Streamed rows are not added to the
+        cache, so a huge category does not evict the hot pages.
+        """
+
+        def batches():
+            batch = []
+            for row in rows:
+                batch.append(self.fragment(row, store=False))
+                if len(batch) == STREAM_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def generate_ndjson():
+            for batch in batches():
+                yield b"\n".join(batch) + b"\n"
+
+        def generate_json():
+            separator = b'{"questions":['
+            for batch in batches():
+                yield separator + b",".join(batch)
+                separator = b","
+            if separator != b",":
+                yield separator
+            yield b"]" + encode_fields(fields)
+
+        if mode == "ndjson":
+            return current_app.response_class(
+                stream_with_context(generate_ndjson()), mimetype="application/x-ndjson"
+            )
+        return current_app.response_class(
+            stream_with_context(generate_json()), mimetype="application/json"
+        )
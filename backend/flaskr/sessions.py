@@ -0,0 +1,228 @@
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# seconds a quiz session stays alive after its last request
+DEFAULT_SESSION_TTL = 60 * 60
+DEFAULT_MAX_SESSIONS = 100000
+
+
+# bytes per id of the packed form of a sparse SeenSet
+SPARSE_ID_SIZE = 4
+
+
+"""
+SeenSet
+    the question ids of a session, as a bitmap from the lowest id on while
+    that takes at most SPARSE_ID_SIZE bytes per id, otherwise as a plain set,
+    so its size follows the number of ids rather than how large they are
+
+"""
+
+
+class SeenSet:
+    __slots__ = ("base", "bits", "ids", "count", "low", "high")
+
+    def __init__(self, ids=(), bits=None, base=0):
+        # id of the first bit (a multiple of 8), or None while `ids` is used
+        self.base = None if bits is None else base
+        self.bits = bytearray(bits or b"")
+        self.ids = set() if bits is None else None
+        present = list(iter(self))
+        self.count = len(present)
+        self.low = present[0] if present else None
+        self.high = present[-1] if present else None
+        for question_id in ids:
+            self.add(question_id)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, question_id):
+        if self.ids is not None:
+            return question_id in self.ids
+        if not isinstance(question_id, int) or question_id < self.base:
+            return False
+        offset = question_id - self.base
+        index = offset >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (offset & 7)))
+
+    def __iter__(self):
+        if self.ids is not None:
+            yield from sorted(self.ids)
+            return
+        for index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield self.base + ((index << 3) | bit)
+
+    def add(self, question_id):
+        if question_id in self:
+            return
+        self.count += 1
+        self.low = question_id if self.low is None else min(self.low, question_id)
+        self.high = question_id if self.high is None else max(self.high, question_id)
+        bitmap_size = (self.high - (self.low & ~7)) // 8 + 1
+        if self.ids is not None:
+            self.ids.add(question_id)
+            if bitmap_size <= self.count * SPARSE_ID_SIZE:
+                ids, self.ids = self.ids, None
+                self.base = self.low & ~7
+                self.bits = bytearray(bitmap_size)
+                for question_id in ids:
+                    self._set(question_id)
+        # twice the threshold, so a set near it does not flip back and forth
+        elif bitmap_size > 2 * self.count * SPARSE_ID_SIZE:
+            self.ids = set(self)
+            self.ids.add(question_id)
+            self.base = None
+            self.bits = bytearray()
+        else:
+            self._set(question_id)
+
+    def _set(self, question_id):
+        if question_id < self.base:
+            base = question_id & ~7
+            self.bits[:0] = bytes((self.base - base) // 8)
+            self.base = base
+        offset = question_id - self.base
+        index = offset >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (offset & 7)
+
+    def to_bytes(self):
+        """`b<base>` or `i`, and the bitmap or the packed ids."""
+        if self.ids is not None:
+            ids = sorted(self.ids)
+            return "i", struct.pack("<{}I".format(len(ids)), *ids)
+        return "b{}".format(self.base), bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, kind, data):
+        if kind == "i":
+            return cls(struct.unpack("<{}I".format(len(data) // SPARSE_ID_SIZE), data))
+        return cls(bits=data, base=int(kind[1:]))
+
+
+"""
+QuizSession
+    the category and already asked questions of one quiz, and its target
+    difficulty, which an adaptive quiz moves after every answer
+
+"""
+
+
+class QuizSession:
+    __slots__ = ("id", "category", "seen", "difficulty", "adaptive")
+
+    def __init__(self, id, category, seen=None, difficulty=None, adaptive=False):
+        self.id = id
+        self.category = category
+        self.seen = seen if seen is not None else SeenSet()
+        self.difficulty = difficulty
+        self.adaptive = adaptive
+
+    def to_bytes(self):
+        """Serialize the session for stores that keep bytes (redis, memcached, ...)."""
+        category = "" if self.category is None else str(self.category)
+        difficulty = "" if self.difficulty is None else repr(self.difficulty)
+        kind, seen = self.seen.to_bytes()
+        header = "\t".join(
+            (category, difficulty, "a" if self.adaptive else "", kind)
+        )
+        return header.encode() + b"\n" + seen
+
+    @classmethod
+    def from_bytes(cls, id, data):
+        header, _, seen = data.partition(b"\n")
+        category, difficulty, adaptive, kind = header.decode().split("\t")
+        return cls(
+            id,
+            category or None,
+            SeenSet.from_bytes(kind, seen),
+            float(difficulty) if difficulty else None,
+            adaptive == "a",
+        )
+
+
+"""
+SessionStore
+    interface of the quiz session storage backends; subclass it and set
+    app.extensions["quiz_sessions"] to use a shared store
+
+"""
+
+
+class SessionStore:
+    def __init__(self, ttl=DEFAULT_SESSION_TTL):
+        self.ttl = ttl
+
+    def create(self, category, difficulty=None, adaptive=False):
+        session = QuizSession(
+            secrets.token_urlsafe(16), category, difficulty=difficulty, adaptive=adaptive
+        )
+        self.save(session)
+        return session
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+"""
+MemorySessionStore
+    in-process session store with sliding TTL eviction
+
+"""
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        super().__init__(ttl)
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session id -> (expires at, session), least recently used first
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (now + self.ttl, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def save(self, session):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session.id] = (now + self.ttl, session)
+            self._sessions.move_to_end(session.id)
+            self._evict(now)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
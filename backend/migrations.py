@@ -0,0 +1,148 @@
+"""
+Schema migrations
+
+    flask upgrade-db
+
+Each migration is a function of an SQLAlchemy connection. Migrations run in
+order, inside one transaction each, and are recorded in the schema_migrations
+table. They inspect the schema before changing it, so on a database created
+by `flask create-db` they only record themselves.
+"""
+import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+
+from models import db, Question
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String),
+    Column("applied_at", DateTime),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(function):
+        MIGRATIONS.append((version, name, function))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return function
+
+    return register
+
+
+def _category_is_integer_fk(connection):
+    inspector = inspect(connection)
+    columns = {column["name"]: column for column in inspector.get_columns("questions")}
+    is_integer = isinstance(columns["category"]["type"], Integer)
+    has_foreign_key = any(
+        foreign_key["referred_table"] == "categories"
+        for foreign_key in inspector.get_foreign_keys("questions")
+    )
+    return is_integer, has_foreign_key
+
+
+@migration(1, "questions.category as an integer foreign key to categories.id")
+def category_integer_foreign_key(connection):
+    is_integer, has_foreign_key = _category_is_integer_fk(connection)
+    if is_integer and has_foreign_key:
+        return
+
+    if connection.dialect.name == "sqlite":
+        # SQLite cannot change a column type, so the table is rebuilt
+        index_names = [index.name for index in Question.__table__.indexes]
+        for name in index_names:
+            connection.execute(text("DROP INDEX IF EXISTS {}".format(name)))
+        connection.execute(text("ALTER TABLE questions RENAME TO questions_old"))
+        Question.__table__.create(connection)
+        connection.execute(
+            text(
+                "INSERT INTO questions (id, question, answer, category, difficulty) "
+                "SELECT id, question, answer, "
+                "CASE WHEN CAST(category AS INTEGER) IN (SELECT id FROM categories) "
+                "THEN CAST(category AS INTEGER) END, difficulty FROM questions_old"
+            )
+        )
+        connection.execute(text("DROP TABLE questions_old"))
+        return
+
+    if not is_integer:
+        # blank or non-numeric categories cannot be cast; they become NULL
+        connection.execute(
+            text("UPDATE questions SET category = NULL WHERE category !~ '^[0-9]+$'")
+        )
+        connection.execute(
+            text(
+                "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+                "USING category::integer"
+            )
+        )
+    if not has_foreign_key:
+        # questions of deleted categories get NULL, as ON DELETE SET NULL would do
+        connection.execute(
+            text(
+                "UPDATE questions SET category = NULL WHERE category IS NOT NULL "
+                "AND category NOT IN (SELECT id FROM categories)"
+            )
+        )
+        connection.execute(
+            text(
+                "ALTER TABLE questions ADD CONSTRAINT questions_category_fkey "
+                "FOREIGN KEY (category) REFERENCES categories (id) "
+                "ON UPDATE CASCADE ON DELETE SET NULL"
+            )
+        )
+
+
+def _create_index(connection, name):
+    for index in Question.__table__.indexes:
+        if index.name == name:
+            index.create(connection, checkfirst=True)
+
+
+@migration(2, "index questions on (category, id)")
+def category_index(connection):
+    _create_index(connection, "ix_questions_category_id")
+
+
+@migration(3, "index questions on their text")
+def question_index(connection):
+    _create_index(connection, "ix_questions_question")
+
+
+def upgrade(engine):
+    """Apply the pending migrations and return their names."""
+    applied = []
+    with engine.begin() as connection:
+        metadata.create_all(connection)
+        done = {row.version for row in connection.execute(schema_migrations.select())}
+    for version, name, function in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            function(connection)
+            connection.execute(
+                schema_migrations.insert().values(
+                    version=version, name=name, applied_at=datetime.datetime.utcnow()
+                )
+            )
+        applied.append(name)
+    return applied
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    """Apply the pending schema migrations."""
+    applied = upgrade(db.engine)
+    for name in applied:
+        click.echo("Applied: {}".format(name))
+    if not applied:
+        click.echo("The database schema is up to date.")
@@ -1,32 +1,211 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import time
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine
+from sqlalchemy.pool import QueuePool, StaticPool
 from flask_sqlalchemy import SQLAlchemy
 import json
 from dotenv import dotenv_values
+from routing import ReplicaRouter, RoutingSQLAlchemy, replica_bind_key
 
-config = dotenv_values()
-database_name = config["DBNAME"]
-database_path = "postgresql://{}:{}@{}/{}".format(
-    config["USERNAME"],
-    config["PASSWORD"],
-    config["HOSTNAME"] + ":" + config["PORT"],
-    database_name,
-)
+db = RoutingSQLAlchemy()
+
+# rows per multi-row INSERT of Question.insert_all
+INSERT_BATCH_SIZE = 1000
+
+# the .env settings, read on first use rather than at import
+_dotenv = None
+
+
+def load_config():
+    global _dotenv
+    if _dotenv is None:
+        _dotenv = dotenv_values()
+    return _dotenv
+
+
+def config_value(name, default=None, type=str, config=None):
+    """A setting from `config` (e.g. app.config), else from .env, else `default`."""
+    value = config.get(name) if config is not None else None
+    if value is None:
+        value = load_config().get(name)
+    if value is None or value == "":
+        return default
+    if not isinstance(value, str):
+        return value
+    if type is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(value)
+
+
+"""
+database_url(config)
+    DATABASE_URL (e.g. sqlite:///trivia.db, or sqlite:// for an in-memory
+    database) when set, otherwise the Postgres URL built from DBNAME,
+    USERNAME, PASSWORD, HOSTNAME and PORT
+"""
+
+
+def database_url(config=None):
+    url = config_value("DATABASE_URL", None, str, config)
+    if url:
+        return url
+    names = ("USERNAME", "PASSWORD", "HOSTNAME", "PORT", "DBNAME")
+    values = [config_value(name, None, str, config) for name in names]
+    missing = [name for name, value in zip(names, values) if value is None]
+    if missing:
+        raise RuntimeError(
+            "Set DATABASE_URL, or {} in .env".format(", ".join(missing))
+        )
+    return "postgresql://{}:{}@{}:{}/{}".format(*values)
+
+
+def is_memory_database(database_path):
+    return database_path in ("sqlite://", "sqlite:///:memory:")
+
+
+"""
+TimedQueuePool
+    a QueuePool that records how long checkouts wait for a free connection
+
+"""
+
+
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        connection = super()._do_get()
+        waited = time.perf_counter() - started
+        self.checkouts += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return connection
+
+
+"""
+engine_options(database_path, config)
+    SQLAlchemy engine options read from `config` or the .env file:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT (ms) and DB_CONNECT_TIMEOUT (s)
+"""
+
+
+def engine_options(database_path, config=None):
+    if is_memory_database(database_path):
+        # one connection shared by every thread, or each would see its own
+        # empty database
+        return {
+            "poolclass": StaticPool,
+            "connect_args": {"check_same_thread": False},
+        }
+    if database_path.startswith("sqlite"):
+        # SQLite connections are not pooled
+        return {}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": config_value("DB_POOL_SIZE", 5, int, config),
+        "max_overflow": config_value("DB_MAX_OVERFLOW", 10, int, config),
+        "pool_timeout": config_value("DB_POOL_TIMEOUT", 30, int, config),
+        "pool_recycle": config_value("DB_POOL_RECYCLE", 1800, int, config),
+        "pool_pre_ping": config_value("DB_POOL_PRE_PING", True, bool, config),
+    }
+    if database_path.startswith("postgresql"):
+        connect_args = {
+            "connect_timeout": config_value("DB_CONNECT_TIMEOUT", 10, int, config),
+            "application_name": config_value(
+                "DB_APPLICATION_NAME", "trivia-api", str, config
+            ),
+        }
+        statement_timeout = config_value("DB_STATEMENT_TIMEOUT", None, int, config)
+        if statement_timeout:
+            connect_args["options"] = "-c statement_timeout={}".format(
+                statement_timeout
+            )
+        options["connect_args"] = connect_args
+    return options
 
-db = SQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service to `database_path`,
+    by default SQLALCHEMY_DATABASE_URI from the app config or database_url();
+    read-only views are routed to the replicas listed in DB_REPLICA_URLS
+    (comma separated) when there are any;
+    the schema is created with `flask create-db`, not on every start, except
+    for an in-memory database, which starts empty
 """
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replica_paths=None):
+    if database_path is None:
+        database_path = app.config.get("SQLALCHEMY_DATABASE_URI") or database_url(
+            app.config
+        )
+    if replica_paths is None:
+        replica_paths = [
+            path.strip()
+            for path in config_value("DB_REPLICA_URLS", "", str, app.config).split(",")
+            if path.strip()
+        ]
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path, app.config)
+    app.config["SQLALCHEMY_BINDS"] = {
+        replica_bind_key(index): path for index, path in enumerate(replica_paths)
+    }
+    app.extensions["replica_router"] = (
+        ReplicaRouter(app.config["SQLALCHEMY_BINDS"]) if replica_paths else None
+    )
     db.app = app
     db.init_app(app)
+    app.cli.add_command(create_db_command)
+    if is_memory_database(database_path):
+        with app.app_context():
+            db.create_all()
+
+
+@click.command("create-db")
+@with_appcontext
+def create_db_command():
+    """Create the trivia tables that do not exist yet."""
     db.create_all()
+    click.echo("Created the database tables.")
+
+
+"""
+pool_status()
+    connection pool usage of the current app's engine
+"""
+
+
+def pool_status():
+    pool = db.engine.pool
+    status = {"pool": pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+        )
+    if isinstance(pool, TimedQueuePool):
+        status.update(
+            {
+                "checkouts": pool.checkouts,
+                "wait_seconds_total": pool.wait_seconds,
+                "wait_seconds_max": pool.max_wait_seconds,
+            }
+        )
+    return status
 
 
 """
@@ -37,11 +216,20 @@ Question
 
 class Question(db.Model):
     __tablename__ = "questions"
+    __table_args__ = (
+        # category pages and counts seek on (category, id)
+        Index("ix_questions_category_id", "category", "id"),
+        # imports skip the questions whose text is in the bank already; a hash
+        # index on Postgres, whose btree entries cannot hold very long texts
+        Index("ix_questions_question", "question", postgresql_using="hash"),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(
+        Integer, ForeignKey("categories.id", onupdate="CASCADE", ondelete="SET NULL")
+    )
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -54,6 +242,39 @@ class Question(db.Model):
         db.session.add(self)
         db.session.commit()
 
+    @staticmethod
+    def insert_all(questions):
+        """Insert `questions` in one transaction and set their ids."""
+        if not db.engine.dialect.full_returning:
+            # without RETURNING the ORM needs one INSERT per row to learn each
+            # new id; SQLite runs them in-process, so this costs no round trips
+            db.session.add_all(questions)
+            db.session.commit()
+            return
+        table = Question.__table__
+        for start in range(0, len(questions), INSERT_BATCH_SIZE):
+            batch = questions[start : start + INSERT_BATCH_SIZE]
+            # one multi-row INSERT per batch; Postgres returns the ids in the
+            # order of the VALUES rows
+            result = db.session.execute(
+                table.insert()
+                .values(
+                    [
+                        {
+                            "question": question.question,
+                            "answer": question.answer,
+                            "category": question.category,
+                            "difficulty": question.difficulty,
+                        }
+                        for question in batch
+                    ]
+                )
+                .returning(table.c.id)
+            )
+            for question, (question_id,) in zip(batch, result):
+                question.id = question_id
+        db.session.commit()
+
     def update(self):
         db.session.commit()
 
@@ -0,0 +1,122 @@
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm, text
+
+# seconds between health checks of a replica
+REPLICA_HEALTH_INTERVAL = 10
+
+
+def replica_bind_key(index):
+    return "replica_{}".format(index)
+
+
+"""
+ReplicaRouter
+    round-robin choice among the healthy read replicas of an app
+
+"""
+
+
+class ReplicaRouter:
+    def __init__(self, bind_keys, health_interval=REPLICA_HEALTH_INTERVAL):
+        self.bind_keys = list(bind_keys)
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._cycle = itertools.cycle(self.bind_keys)
+        # bind key -> (healthy, checked at)
+        self._health = {}
+        self._watched = set()
+
+    def mark_down(self, bind_key):
+        with self._lock:
+            self._health[bind_key] = (False, time.monotonic())
+
+    def _watch(self, engine, bind_key):
+        # a dropped connection takes the replica out until its next health check
+        def handle_error(context):
+            if context.is_disconnect:
+                self.mark_down(bind_key)
+
+        event.listen(engine, "handle_error", handle_error)
+        self._watched.add(bind_key)
+
+    def is_healthy(self, db, app, bind_key):
+        healthy, checked_at = self._health.get(bind_key, (None, 0))
+        if healthy is not None and time.monotonic() - checked_at < self.health_interval:
+            return healthy
+
+        engine = db.get_engine(app, bind=bind_key)
+        if bind_key not in self._watched:
+            self._watch(engine, bind_key)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            healthy = True
+        except Exception as e:
+            print(e)
+            healthy = False
+        with self._lock:
+            self._health[bind_key] = (healthy, time.monotonic())
+        return healthy
+
+    def choose(self, db, app):
+        """Return the bind key of the next healthy replica, or None for the primary."""
+        for _ in range(len(self.bind_keys)):
+            with self._lock:
+                bind_key = next(self._cycle)
+            if self.is_healthy(db, app, bind_key):
+                return bind_key
+        return None
+
+    def status(self):
+        return {
+            bind_key: self._health.get(bind_key, (None, 0))[0]
+            for bind_key in self.bind_keys
+        }
+
+
+def read_only(view):
+    """Mark a view as read-only so its queries may go to a replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+"""
+RoutingSession
+    sends the queries of read-only requests to a replica, chosen once per
+    request; writes and everything else stay on the primary
+
+"""
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if (
+            has_app_context()
+            and g.get("read_only")
+            and not self._flushing
+            and not (self.new or self.dirty or self.deleted)
+        ):
+            router = self.app.extensions.get("replica_router")
+            if router is not None:
+                db = get_state(self.app).db
+                if "replica_bind" not in g:
+                    g.replica_bind = router.choose(db, self.app)
+                if g.replica_bind is not None:
+                    return db.get_engine(self.app, bind=g.replica_bind)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
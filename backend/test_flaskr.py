@@ -1,38 +1,123 @@
+import asyncio
+import gzip
+import io
 import os
+import random
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
-from dotenv import dotenv_values
+from flask import Flask, g
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects.postgresql.base import PGCompiler
+from sqlalchemy.dialects.sqlite.base import SQLiteCompiler
+from sqlalchemy.pool import StaticPool
+from unittest import mock
 
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from bulk import (
+    export_table,
+    import_categories,
+    import_questions,
+    read_records,
+    QUESTION_FIELDS,
+)
+from models import (
+    db,
+    setup_db,
+    config_value,
+    engine_options,
+    TimedQueuePool,
+    Question,
+    Category,
+)
+from flaskr.asgi import TriviaASGI, async_database_url
+from flaskr.cache import DataSignature, QuestionWatch
+from flaskr.caching import cache_control, init_caching
+from flaskr.coalescing import CachedResult, ResultCache, SingleFlight
+from flaskr.compression import init_compression
+from migrations import upgrade
+from flaskr.metrics import init_metrics
+from flaskr.ratelimit import init_rate_limit
+from flaskr.sampling import IdBucket, QuestionSampler
+from flaskr.search import SearchIndex
+from flaskr.serialization import QuestionFragments
+from flaskr.sessions import MemorySessionStore, QuizSession, SeenSet
+
+
+# an in-memory SQLite database unless TEST_DATABASE_URL names another one
+TEST_DATABASE_URL = config_value("TEST_DATABASE_URL", "sqlite://")
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trivia.psql")
+app = None
+
+
+def sample_rows(table):
+    """The rows of `table` in the COPY blocks of trivia.psql, as dicts."""
+    with open(SAMPLE_DATA) as f:
+        lines = iter(f.read().splitlines())
+    for line in lines:
+        if line.startswith("COPY public.{} (".format(table)):
+            columns = line[line.index("(") + 1 : line.index(")")].split(", ")
+            break
+    rows = []
+    for line in lines:
+        if line == "\\.":
+            break
+        rows.append(dict(zip(columns, line.split("\t"))))
+    return rows
+
+
+def setUpModule():
+    """Build the schema and load the sample data once for every test."""
+    global app
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": TEST_DATABASE_URL})
+    with app.app_context():
+        db.create_all()
+        if Category.query.count() == 0:
+            db.session.execute(Category.__table__.insert(), sample_rows("categories"))
+            db.session.execute(Question.__table__.insert(), sample_rows("questions"))
+            if db.engine.dialect.name == "postgresql":
+                for table in ("categories", "questions"):
+                    db.session.execute(
+                        text(
+                            "SELECT setval('{0}_id_seq', (SELECT MAX(id) FROM {0}))".format(
+                                table
+                            )
+                        )
+                    )
+            db.session.commit()
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Define test variables and run each test in a transaction."""
+        self.app = app
         self.client = self.app.test_client
-        config = dotenv_values()
-        self.database_name = config["DBNAME"]
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            config["USERNAME"],
-            config["PASSWORD"],
-            config["HOSTNAME"] + ":" + config["PORT"],
-            self.database_name,
-        )
-
-        setup_db(self.app, self.database_path)
+        self.context = self.app.app_context()
+        self.context.push()
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        # everything the test commits is rolled back in tearDown
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = db.create_scoped_session(
+            options={"bind": self.connection, "binds": {}}
+        )
+        # in-memory state must not outlive the rolled back rows
+        for name in (
+            "question_sampler",
+            "search_index",
+            "question_watch",
+            "question_counter",
+            "category_cache",
+        ):
+            self.app.extensions[name].invalidate()
+        self.app.extensions["question_fragments"].clear()
+        self.app.extensions["single_flight"].cache.clear()
 
         self.new_question = {
             "question": "who invented computer",
@@ -50,7 +135,11 @@ class TriviaTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        self.context.pop()
 
     # Test cases for listing all categories
     def test_all_categories(self):
@@ -60,6 +149,31 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["categories"]))
 
+    def test_all_categories_not_modified(self):
+        res = self.client().get("/categories")
+        etag = res.headers["ETag"]
+        res = self.client().get("/categories", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+
+    def test_get_questions_compressed_and_revalidated(self):
+        res = self.client().get("/questions", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(res.headers["Cache-Control"], "no-cache")
+        self.assertTrue(json.loads(gzip.decompress(res.data))["success"])
+        etag = res.headers["ETag"]
+        res = self.client().get(
+            "/questions", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        self.assertEqual(res.status_code, 304)
+
+        self.client().post("/questions", json=self.new_question)
+        res = self.client().get(
+            "/questions", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        self.assertEqual(res.status_code, 200)
+
     def test_404_all_categories(self):
         res = self.client().get("/categories/1")
         data = json.loads(res.data)
@@ -75,6 +189,23 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["questions"]))
 
+    def test_get_questions_after_cursor(self):
+        res = self.client().get("/questions?limit=5")
+        data = json.loads(res.data)
+        self.assertEqual(len(data["questions"]), 5)
+        self.assertEqual(data["next_after"], data["questions"][-1]["id"])
+        res = self.client().get("/questions?limit=5&after={}".format(data["next_after"]))
+        next_data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_data["questions"][0]["id"], data["next_after"])
+        self.assertEqual(next_data["total_questions"], data["total_questions"])
+
+    def test_404_get_questions_page_out_of_range(self):
+        res = self.client().get("/questions?page=1000")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
     def test_404_get_questions(self):
         res = self.client().get("/questionss")
         data = json.loads(res.data)
@@ -89,7 +220,71 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
         self.assertTrue(data["created"])
-        return data["questions"][-1]["id"]
+        self.assertEqual(data["question"]["id"], data["created"])
+        self.assertNotIn("questions", data)
+        return data["created"]
+
+    def test_add_question_with_question_list(self):
+        res = self.client().post("/questions?include=questions", json=self.new_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), data["total_questions"])
+        self.client().delete("/questions/{}".format(data["created"]))
+
+    def test_add_questions_in_bulk(self):
+        res = self.client().post(
+            "/questions/bulk",
+            data="\n".join(json.dumps(self.new_question) for _ in range(3)),
+            content_type="application/x-ndjson",
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["created"]), 3)
+        for question_id in data["created"]:
+            self.client().delete("/questions/{}".format(question_id))
+
+    @unittest.skipUnless(TEST_DATABASE_URL.startswith("postgresql"), "needs Postgres")
+    def test_add_questions_in_bulk_is_one_insert(self):
+        statements = []
+
+        def count_inserts(conn, cursor, statement, *args):
+            if statement.startswith("INSERT"):
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count_inserts)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", count_inserts)
+        res = self.client().post("/questions/bulk", json=[self.new_question] * 5)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(len(set(data["created"])), 5)
+
+    def test_add_questions_in_bulk_with_returning_changes_etag(self):
+        # SQLite has RETURNING but SQLAlchemy 1.4 does not compile it there
+        for patcher in (
+            mock.patch.object(
+                SQLiteCompiler, "returning_clause", PGCompiler.returning_clause
+            ),
+            mock.patch.object(db.engine.dialect, "full_returning", True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        etag = self.client().get("/questions").headers["ETag"]
+        res = self.client().post("/questions/bulk", json=[self.new_question] * 3)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(set(data["created"])), 3)
+        res = self.client().get("/questions", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+    def test_400_add_questions_in_bulk(self):
+        res = self.client().post(
+            "/questions/bulk", json=[self.new_question, self.new_question_invalid_body]
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
 
     def test_400_get_questions(self):
         res = self.client().post("/questions", json=self.new_question_invalid_body)
@@ -122,6 +317,35 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["questions"]))
 
+    def test_search_question_paginated(self):
+        res = self.client().post("/questions/search?limit=2", json={"searchTerm": "the"})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), 2)
+        self.assertGreater(data["total_questions"], 2)
+        self.assertEqual(data["next_after"], data["questions"][-1]["id"])
+
+    def test_400_search_term_not_a_string(self):
+        res = self.client().post("/questions/search", json={"searchTerm": 5})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["message"], "Bad Request")
+
+    def test_search_sees_questions_added_by_other_workers(self):
+        watch = self.app.extensions["question_watch"]
+        watch.interval = 0
+        self.addCleanup(setattr, watch, "interval", 1.0)
+        self.client().post("/questions/search", json={"searchTerm": "Tom"})
+        # written behind the app's back, as another worker would
+        db.session.execute(
+            Question.__table__.insert().values(
+                question="Who wrote Zyxwv?", answer="a", category=4, difficulty=1
+            )
+        )
+        res = self.client().post("/questions/search", json={"searchTerm": "zyxwv"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["total_questions"], 1)
+
     def test_404_search_no_question(self):
         res = self.client().post("/questions/search", json={"searchTerm": "test111"})
         data = json.loads(res.data)
@@ -137,6 +361,21 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["questions"]))
 
+    def test_get_ques_from_category_paginated(self):
+        res = self.client().get("/categories/4/questions?limit=2")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), 2)
+        self.assertEqual(data["total_questions"], 4)
+        self.assertEqual(data["next_after"], data["questions"][-1]["id"])
+
+    def test_stream_ques_from_category(self):
+        res = self.client().get("/categories/4/questions?stream=ndjson")
+        lines = res.data.decode().splitlines()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertEqual([json.loads(line)["category"] for line in lines], [4] * 4)
+
     def test_404_get_ques_from_invalid_category(self):
         res = self.client().get("/categories/10/questions")
         data = json.loads(res.data)
@@ -159,6 +398,753 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Bad Request")
 
+    def test_quizz_skips_previous_questions(self):
+        res = self.client().post(
+            "/quizzes", json={"quiz_category": 4, "previous_questions": [5, 9, 12]}
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["id"], 23)
+
+    def test_quizz_sees_questions_added_by_other_workers(self):
+        watch = self.app.extensions["question_watch"]
+        watch.interval = 0
+        self.addCleanup(setattr, watch, "interval", 1.0)
+        self.client().post("/quizzes", json=self.new_quizz)
+        # written behind the app's back, as another worker would
+        question_id = db.session.execute(
+            Question.__table__.insert().values(
+                question="q", answer="a", category=4, difficulty=1
+            )
+        ).inserted_primary_key[0]
+        res = self.client().post(
+            "/quizzes", json={"quiz_category": 4, "previous_questions": [5, 9, 12, 23]}
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["id"], question_id)
+
+    # Test cases for quiz session endpoints
+    def test_quiz_session(self):
+        res = self.client().post("/quizzes/sessions", json={"quiz_category": 4})
+        session_id = json.loads(res.data)["session_id"]
+        seen = set()
+        for _ in range(4):
+            res = self.client().post("/quizzes/sessions/{}/next".format(session_id))
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            seen.add(data["question"]["id"])
+        self.assertEqual(seen, {5, 9, 12, 23})
+        res = self.client().post("/quizzes/sessions/{}/next".format(session_id))
+        self.assertIsNone(json.loads(res.data)["question"])
+
+    def test_adaptive_quiz_session(self):
+        res = self.client().post(
+            "/quizzes/sessions", json={"quiz_category": 4, "adaptive": True}
+        )
+        data = json.loads(res.data)
+        self.assertEqual(data["difficulty"], 3)
+        path = "/quizzes/sessions/{}/next".format(data["session_id"])
+        self.client().post(path)
+        res = self.client().post(path, json={"correct": True})
+        self.assertEqual(json.loads(res.data)["difficulty"], 3.5)
+        res = self.client().post(path, json={"correct": False})
+        self.assertEqual(json.loads(res.data)["difficulty"], 3)
+        res = self.client().post(path, json={"correct": "yes"})
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_quizz_invalid_difficulty(self):
+        res = self.client().post(
+            "/quizzes",
+            json={"quiz_category": 4, "previous_questions": [], "difficulty": 6},
+        )
+        self.assertEqual(res.status_code, 400)
+
+    def test_404_quiz_session_unknown(self):
+        res = self.client().post("/quizzes/sessions/unknown/next")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
+    @unittest.skipUnless(TEST_DATABASE_URL.startswith("postgresql"), "needs Postgres")
+    def test_pool_metrics(self):
+        res = self.client().get("/metrics/pool")
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["pool"]["pool"], "TimedQueuePool")
+        self.assertIn("checked_out", data["pool"])
+
+    @unittest.skipUnless(TEST_DATABASE_URL.startswith("postgresql"), "needs Postgres")
+    def test_category_query_uses_index(self):
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                # the sample table is tiny, so make the planner show its index choice
+                connection.execute(text("SET enable_seqscan = off"))
+                plan = connection.execute(
+                    text(
+                        "EXPLAIN SELECT id FROM questions "
+                        "WHERE category = 4 ORDER BY id LIMIT 10"
+                    )
+                ).scalars().all()
+        self.assertIn("ix_questions_category_id", "\n".join(plan))
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """This class represents the schema migrations test case"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            "sqlite:///" + os.path.join(self.directory.name, "legacy.db")
+        )
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE categories (id INTEGER PRIMARY KEY, type TEXT)"))
+            connection.execute(
+                text(
+                    "CREATE TABLE questions (id INTEGER PRIMARY KEY, question TEXT, "
+                    "answer TEXT, category VARCHAR, difficulty INTEGER)"
+                )
+            )
+            connection.execute(text("INSERT INTO categories VALUES (1, 'Science'), (4, 'History')"))
+            connection.execute(
+                text(
+                    "INSERT INTO questions VALUES (5, 'q5', 'a', '4', 2), "
+                    "(20, 'q20', 'a', '1', 4), (30, 'q30', 'a', '99', 1)"
+                )
+            )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_upgrade_converts_category_and_adds_index(self):
+        self.assertEqual(len(upgrade(self.engine)), 3)
+        self.assertEqual(upgrade(self.engine), [])
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text("SELECT id, category, typeof(category) FROM questions ORDER BY id")
+            ).all()
+            plan = connection.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT id FROM questions "
+                    "WHERE category = 4 ORDER BY id LIMIT 10"
+                )
+            ).all()
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [(5, 4, "integer"), (20, 1, "integer"), (30, None, "null")],
+        )
+        self.assertIn("ix_questions_category_id", " ".join(str(step[-1]) for step in plan))
+
+    def test_upgrade_indexes_question_text(self):
+        upgrade(self.engine)
+        with self.engine.connect() as connection:
+            # the lookup made for every staged row of an import
+            plan = connection.execute(
+                text("EXPLAIN QUERY PLAN SELECT 1 FROM questions WHERE question = 'q5'")
+            ).all()
+        self.assertIn("ix_questions_question", " ".join(str(step[-1]) for step in plan))
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class represents the engine configuration test case"""
+
+    def test_postgres_engine_is_pooled(self):
+        options = engine_options("postgresql://student@localhost/trivia")
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertIn("connect_timeout", options["connect_args"])
+
+    def test_sqlite_engine_is_not_pooled(self):
+        self.assertEqual(engine_options("sqlite:///trivia.db"), {})
+        self.assertIs(engine_options("sqlite://")["poolclass"], StaticPool)
+
+    def test_async_database_url(self):
+        self.assertEqual(
+            async_database_url("postgresql://student@localhost:5432/trivia"),
+            "postgresql+asyncpg://student@localhost:5432/trivia",
+        )
+        self.assertEqual(async_database_url("sqlite:///trivia.db"), "sqlite+aiosqlite:///trivia.db")
+        with self.assertRaises(ValueError):
+            async_database_url("mysql://localhost/trivia")
+        # the async engine would open a second, empty database
+        with self.assertRaises(ValueError):
+            async_database_url("sqlite://")
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        primary, replica = (
+            "sqlite:///" + os.path.join(self.directory.name, name)
+            for name in ("primary.db", "replica.db")
+        )
+        self.app = Flask(__name__)
+        setup_db(self.app, primary, [replica])
+        with self.app.app_context():
+            db.create_all()
+            Question.__table__.create(db.get_engine(bind="replica_0"))
+            db.session.add(Question("only on the primary", "yes", "1", 1))
+            db.session.commit()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reads_go_to_replica(self):
+        with self.app.test_request_context():
+            g.read_only = True
+            self.assertEqual(Question.query.count(), 0)
+
+    def test_writes_stay_on_primary(self):
+        with self.app.test_request_context():
+            self.assertEqual(Question.query.count(), 1)
+
+
+class ASGITestCase(unittest.TestCase):
+    """This class represents the ASGI quiz endpoints test case"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app(
+            {
+                "DATABASE_URL": "sqlite:///"
+                + os.path.join(self.directory.name, "trivia.db")
+            }
+        )
+        with self.app.app_context():
+            db.create_all()
+            db.session.execute(Category.__table__.insert(), sample_rows("categories"))
+            db.session.execute(Question.__table__.insert(), sample_rows("questions"))
+            db.session.commit()
+        self.asgi = TriviaASGI(self.app)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.asgi.engine.dispose())
+        self.loop.close()
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+        self.directory.cleanup()
+
+    def post(self, path, body):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": json.dumps(body).encode()}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": path,
+            "headers": [],
+            "client": ("10.0.0.1", 50000),
+        }
+        self.loop.run_until_complete(self.asgi(scope, receive, send))
+        self.headers = dict(messages[0]["headers"])
+        return messages[0]["status"], json.loads(messages[1]["body"])
+
+    def test_quizz(self):
+        status, data = self.post(
+            "/quizzes", {"quiz_category": 4, "previous_questions": [5, 9, 12]}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(data["question"]["id"], 23)
+
+    def test_400_quizz(self):
+        status, data = self.post("/quizzes", {"quiz_category": 4})
+        self.assertEqual((status, data["message"]), (400, "Bad Request"))
+        status, data = self.post(
+            "/quizzes", {"quiz_category": 4, "previous_questions": [], "difficulty": 9}
+        )
+        self.assertEqual(status, 400)
+
+    def test_500_quizz_category_exhausted(self):
+        status, data = self.post(
+            "/quizzes", {"quiz_category": 4, "previous_questions": [5, 9, 12, 23]}
+        )
+        self.assertEqual((status, data["success"]), (500, False))
+
+    def test_quizz_is_rate_limited(self):
+        init_rate_limit(self.app, 1, 1)
+        body = {"quiz_category": 4, "previous_questions": []}
+        self.assertEqual(self.post("/quizzes", body)[0], 200)
+        status, data = self.post("/quizzes", body)
+        self.assertEqual((status, data["message"]), (429, "Too Many Requests"))
+        self.assertEqual(self.headers[b"retry-after"], b"1")
+
+    def test_wsgi_routes_run_concurrently(self):
+        # both requests must be inside the route at once to get past it
+        barrier = threading.Barrier(2, timeout=5)
+
+        @self.app.route("/wait")
+        def wait():
+            barrier.wait()
+            return "ok"
+
+        async def get(path):
+            messages = []
+
+            async def receive():
+                return {"type": "http.request", "body": b""}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {"type": "http", "method": "GET", "path": path, "headers": []}
+            scope.update(
+                query_string=b"", server=("localhost", 80), http_version="1.1"
+            )
+            await self.asgi(scope, receive, send)
+            return messages[0]["status"]
+
+        async def both():
+            return await asyncio.gather(get("/wait"), get("/wait"))
+
+        statuses = self.loop.run_until_complete(both())
+        self.assertEqual(statuses, [200, 200])
+
+    def test_quiz_session_next(self):
+        session = self.app.extensions["quiz_sessions"].create("4")
+        path = "/quizzes/sessions/{}/next".format(session.id)
+        seen = set()
+        for _ in range(4):
+            status, data = self.post(path, {})
+            self.assertEqual(status, 200)
+            seen.add(data["question"]["id"])
+        self.assertEqual(seen, {5, 9, 12, 23})
+        status, data = self.post(path, {})
+        self.assertEqual((data["question"], data["questions_seen"]), (None, 4))
+        status, data = self.post("/quizzes/sessions/unknown/next", {})
+        self.assertEqual(status, 404)
+
+
+class MetricsTestCase(unittest.TestCase):
+    """This class represents the request metrics test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        engine = self.engine = create_engine("sqlite://")
+
+        @self.app.route("/two-queries")
+        def two_queries():
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            return "ok"
+
+        @self.app.route("/failed-query")
+        def failed_query():
+            with engine.connect() as connection:
+                try:
+                    connection.execute(text("SELECT * FROM missing"))
+                except Exception:
+                    pass
+                connection.execute(text("SELECT 1"))
+            return "ok"
+
+        init_metrics(self.app, slow_request_seconds=0)
+        self.client = self.app.test_client
+
+    def test_metrics_count_sql_statements(self):
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            self.client().get("/two-queries")
+        self.assertIn("SELECT 2", logs.output[0])
+        res = self.client().get("/metrics")
+        body = res.data.decode()
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'trivia_request_sql_statements_sum{route="/two-queries",method="GET"} 2',
+            body,
+        )
+        self.assertIn(
+            'trivia_response_size_bytes_sum{route="/two-queries",method="GET"} 2.0',
+            body,
+        )
+
+
+    def test_failed_statement_is_not_counted(self):
+        with self.assertLogs(self.app.logger, "WARNING"):
+            self.client().get("/failed-query")
+            self.client().get("/failed-query")
+        body = self.client().get("/metrics").data.decode()
+        self.assertIn(
+            'trivia_request_sql_statements_sum{route="/failed-query",method="GET"} 2',
+            body,
+        )
+        # nothing is left on the pooled connection by the failed statements
+        with self.engine.connect() as connection:
+            self.assertEqual(dict(connection.info), {})
+
+
+class BulkImportTestCase(unittest.TestCase):
+    """This class represents the question import and export test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(Category("Science"))
+        db.session.add(Question("Already here?", "yes", 1, 1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+
+    def test_import_skips_invalid_duplicate_and_unknown_category(self):
+        source = io.StringIO(
+            "question,answer,category,difficulty\n"
+            "New one?,a,1,2\n"
+            "New one?,again,1,3\n"
+            "Already here?,a,1,1\n"
+            "Unknown category?,a,99,1\n"
+            "No difficulty?,a,1,\n"
+        )
+        errors = []
+        read, staged, inserted = import_questions(
+            db.engine, read_records(source, "csv"), errors=errors
+        )
+        self.assertEqual((read, staged, inserted), (5, 4, 1))
+        self.assertEqual([number for number, _ in errors], [5])
+        question = Question.query.filter_by(question="New one?").one()
+        self.assertEqual((question.answer, question.difficulty), ("a", 2))
+
+    def test_import_skips_malformed_lines(self):
+        source = io.StringIO(
+            '{"question": "First?", "answer": "a", "category": 1, "difficulty": 1}\n'
+            '{"question": "Broken?", \n'
+            '{"question": "Third?", "answer": "a", "category": 1, "difficulty": 1}\n'
+        )
+        errors = []
+        read, staged, inserted = import_questions(
+            db.engine, read_records(source, "ndjson"), errors=errors
+        )
+        self.assertEqual((read, staged, inserted), (3, 2, 2))
+        self.assertEqual([number for number, _ in errors], [2])
+
+    def test_import_categories_skips_invalid_records(self):
+        source = io.StringIO(
+            '{"type": "x"}\n{"id": "a", "type": "x"}\n{"id": 7, "type": "Art"}\n'
+        )
+        errors = []
+        read, inserted = import_categories(
+            db.engine, read_records(source, "ndjson"), errors
+        )
+        self.assertEqual((read, inserted), (3, 1))
+        self.assertEqual([number for number, _ in errors], [1, 2])
+        self.assertEqual(Category.query.get(7).type, "Art")
+
+    def test_export_round_trip(self):
+        out = io.StringIO()
+        self.assertEqual(
+            export_table(db.engine, Question.__table__, QUESTION_FIELDS, out, "ndjson"), 1
+        )
+        record = json.loads(out.getvalue())
+        self.assertEqual(record["question"], "Already here?")
+        out.seek(0)
+        self.assertEqual(
+            import_questions(db.engine, read_records(out, "ndjson")), (1, 1, 0)
+        )
+
+
+class CompressionTestCase(unittest.TestCase):
+    """This class represents the response compression and caching test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        with self.app.app_context():
+            db.create_all()
+        init_caching(self.app)
+        init_compression(self.app, min_size=100)
+
+        @self.app.route("/big")
+        @cache_control("no-cache", etag="questions")
+        def big():
+            return {"questions": ["question"] * 100}
+
+        @self.app.route("/small")
+        def small():
+            return {"questions": []}
+
+        self.client = self.app.test_client
+
+    def test_large_body_is_gzipped(self):
+        res = self.client().get("/big", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertEqual(res.headers["Vary"], "Accept-Encoding")
+        self.assertTrue(res.headers["ETag"].endswith('-gzip"'))
+        self.assertEqual(len(json.loads(gzip.decompress(res.data))["questions"]), 100)
+
+    def test_small_body_and_no_accept_encoding_are_not_compressed(self):
+        res = self.client().get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", res.headers)
+        self.assertEqual(res.headers["Cache-Control"], "no-store")
+        res = self.client().get("/big")
+        self.assertNotIn("Content-Encoding", res.headers)
+
+    def test_etag_changes_when_the_questions_change(self):
+        etag = self.client().get("/big").headers["ETag"]
+        res = self.client().get("/big", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        with self.app.app_context():
+            Question("q", "a", None, 1).insert()
+        res = self.client().get("/big", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+
+    def test_etag_is_shared_by_workers(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database_url = "sqlite:///" + os.path.join(directory.name, "trivia.db")
+        workers = []
+        for _ in range(2):
+            worker = Flask(__name__)
+            setup_db(worker, database_url)
+            init_caching(worker)
+            workers.append(worker)
+        first, second = workers
+        with first.app_context():
+            db.create_all()
+            Question("q", "a", None, 1).insert()
+            etag = first.extensions["data_version"].etag("questions")
+        # a worker that never saw the write gives the data the same ETag
+        with second.app_context():
+            self.assertEqual(second.extensions["data_version"].etag("questions"), etag)
+        for worker in workers:
+            with worker.app_context():
+                db.get_engine(worker).dispose()
+
+
+class CoalescingTestCase(unittest.TestCase):
+    """This class represents the request coalescing and rate limiting test case"""
+
+    def test_concurrent_calls_share_one_result(self):
+        flights = SingleFlight(ResultCache(ttl=0))
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return CachedResult(b"body", 200, [], 0)
+
+        def request():
+            results.append(flights.do("key", call))
+
+        leader = threading.Thread(target=request)
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=request) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result.body for result in results], [b"body"] * 6)
+
+    def test_result_cache_evicts_least_recently_used(self):
+        cache = ResultCache(ttl=60, max_size=2)
+        cache.put("a", b"a", 200, [])
+        cache.put("b", b"b", 200, [])
+        cache.get("a")
+        cache.put("c", b"c", 200, [])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a").body, b"a")
+
+    def test_rate_limit_per_client_and_route(self):
+        app = create_app(
+            {"DATABASE_URL": "sqlite://", "RATE_LIMIT": 1, "RATE_LIMIT_BURST": 2}
+        )
+        client = app.test_client()
+        self.assertEqual(client.get("/categories").status_code, 404)
+        self.assertEqual(client.get("/categories").status_code, 404)
+        res = client.get("/categories")
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(json.loads(res.data)["message"], "Too Many Requests")
+        self.assertEqual(res.headers["Retry-After"], "1")
+        # another route and another client have their own buckets
+        self.assertEqual(client.get("/questions").status_code, 404)
+        res = client.get("/categories", environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        self.assertEqual(res.status_code, 404)
+
+
+class IdBucketTestCase(unittest.TestCase):
+    """This class represents the quiz sampling test case"""
+
+    def test_choice_excludes_previous(self):
+        bucket = IdBucket(range(1, 101))
+        for _ in range(200):
+            self.assertNotIn(bucket.choice(set(range(1, 100))), range(1, 100))
+        self.assertIsNone(bucket.choice(set(range(1, 101))))
+
+    def test_remove_keeps_bucket_dense(self):
+        bucket = IdBucket([1, 2, 3])
+        bucket.remove(1)
+        bucket.remove(42)
+        self.assertEqual(sorted(bucket.ids), [2, 3])
+        self.assertEqual({bucket.choice() for _ in range(50)}, {2, 3})
+
+    def test_pick_favours_target_difficulty(self):
+        sampler = QuestionSampler(None, None, rng=random.Random(1))
+        sampler.load((question_id, 1, question_id % 5 + 1) for question_id in range(1000))
+        picks = [sampler.pick(1, (), difficulty=5) for _ in range(1000)]
+        hard = sum(1 for question_id in picks if question_id % 5 + 1 == 5)
+        # weights 1, 1/4, 1/16, ... give difficulty 5 about 75% of the picks
+        self.assertGreater(hard, 650)
+        self.assertLess(hard, 850)
+
+        easy = set(question_id for question_id in range(1000) if question_id % 5 == 0)
+        self.assertNotIn(sampler.pick(1, easy, difficulty=1), easy)
+
+    def test_difficulty_buckets_follow_add_and_remove(self):
+        sampler = QuestionSampler(None, None)
+        sampler.load([(1, 1, 1), (2, 1, 5)])
+        sampler.remove(2)
+        sampler.add(3, 2, 5)
+        self.assertEqual(sampler.pick(1, (), difficulty=5), 1)
+        self.assertEqual(sampler.pick(0, [1], difficulty=1), 3)
+        self.assertIsNone(sampler.pick(2, [3], difficulty=5))
+
+    def test_pulls_only_rows_past_the_highest_id(self):
+        watch = QuestionWatch(None)
+        watch.update(DataSignature((3, 3), (0, 0)))
+        sampler = QuestionSampler(None, watch)
+        sampler.load([(1, 1, 1), (2, 1, 1)])
+        with mock.patch.object(
+            QuestionSampler, "rows", return_value=[(3, 2, 1)]
+        ) as rows:
+            self.assertEqual(sampler.pick(2), 3)
+            self.assertEqual(sampler.pick(2), 3)
+        rows.assert_called_once_with(2)
+
+    def test_expired_sampler_rebuilds_once_in_the_background(self):
+        sampler = QuestionSampler(60)
+        sampler.load([(1, 1, 1)])
+        sampler._loaded_at -= 120
+        release = threading.Event()
+        with app.app_context(), mock.patch.object(
+            QuestionSampler, "refresh", side_effect=lambda: release.wait(5)
+        ) as refresh:
+            # the old buckets keep answering while the rebuild runs
+            self.assertEqual(sampler.pick(1), 1)
+            self.assertEqual(sampler.pick(1), 1)
+            release.set()
+            while sampler._rebuilding:
+                time.sleep(0.01)
+        refresh.assert_called_once_with()
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    """This class represents the search index test case"""
+
+    def setUp(self):
+        self.index = SearchIndex(refresh_interval=None)
+        self.index.load(
+            [
+                (1, "What movie earned Tom Hanks his third straight Oscar?"),
+                (2, "Who invented Peanut Butter?"),
+                (3, "What is the largest lake in Africa?"),
+            ]
+        )
+
+    def test_search_is_case_insensitive_substring(self):
+        self.assertEqual(self.index.search("TOM"), [1])
+        self.assertEqual(self.index.search("what"), [1, 3])
+        self.assertEqual(self.index.search("a"), [1, 2, 3])
+        self.assertEqual(self.index.search("tom cruise"), [])
+
+    def test_search_follows_updates(self):
+        self.index.remove(2)
+        self.index.add(4, "Which peanut is the largest?")
+        self.assertEqual(self.index.search("peanut"), [4])
+        self.assertEqual(self.index.search("largest"), [3, 4])
+
+    def test_pulls_rows_past_the_highest_id(self):
+        self.index.watch = QuestionWatch(None)
+        self.index.watch.update(DataSignature((4, 4), (0, 0)))
+        with mock.patch.object(
+            SearchIndex, "rows", return_value=[(4, "Which lake is the largest?")]
+        ) as rows:
+            self.assertEqual(self.index.search("largest"), [3, 4])
+        rows.assert_called_once_with(3)
+
+    def test_rebuilds_in_the_background_after_foreign_deletes(self):
+        self.index.watch = QuestionWatch(None)
+        self.index.watch.update(DataSignature((2, 3), (0, 0)))
+        with mock.patch.object(SearchIndex, "rebuild_in_background") as rebuild:
+            # answered from the old index until the rebuild swaps in
+            self.assertEqual(self.index.search("peanut"), [2])
+        rebuild.assert_called_once_with()
+
+
+class QuestionFragmentsTestCase(unittest.TestCase):
+    """This class represents the question serialization test case"""
+
+    def test_response_matches_format(self):
+        fragments = QuestionFragments()
+        question = Question("Who invented Peanut Butter?", "Carver", "4", 2)
+        question.id = 12
+        with Flask(__name__).app_context():
+            res = fragments.response([(12, "Who invented Peanut Butter?", "Carver", "4", 2)], success=True)
+        self.assertEqual(
+            json.loads(res.data), {"questions": [question.format()], "success": True}
+        )
+
+    def test_changed_row_is_encoded_again(self):
+        fragments = QuestionFragments()
+        fragments.fragment((1, "q", "old answer", "1", 1))
+        self.assertIn(b"new answer", fragments.fragment((1, "q", "new answer", "1", 1)))
+        self.assertEqual(len(fragments), 1)
+
+
+class QuizSessionTestCase(unittest.TestCase):
+    """This class represents the quiz session store test case"""
+
+    def test_seen_set_round_trip(self):
+        session = QuizSession("abc", "4", SeenSet([5, 9, 1000]))
+        restored = QuizSession.from_bytes("abc", session.to_bytes())
+        self.assertEqual(restored.category, "4")
+        self.assertEqual(list(restored.seen), [5, 9, 1000])
+        self.assertNotIn(6, restored.seen)
+
+    def test_seen_set_size_follows_number_of_ids(self):
+        seen = SeenSet([1_000_000, 1_000_003])
+        self.assertLessEqual(len(seen.to_bytes()[1]), 8)
+        seen.add(1)
+        self.assertLessEqual(len(seen.to_bytes()[1]), 12)
+        self.assertEqual(list(seen), [1, 1_000_000, 1_000_003])
+        for question_id in range(2, 200):
+            seen.add(question_id)
+        self.assertEqual(len(seen), 201)
+        self.assertIn(150, seen)
+        self.assertNotIn(999_999, seen)
+        restored = SeenSet.from_bytes(*seen.to_bytes())
+        self.assertEqual(list(restored), list(seen))
+
+    def test_difficulty_round_trip(self):
+        session = QuizSession("abc", None, difficulty=3.5, adaptive=True)
+        restored = QuizSession.from_bytes("abc", session.to_bytes())
+        self.assertEqual((restored.difficulty, restored.adaptive), (3.5, True))
+
+    def test_memory_store_expires_sessions(self):
+        store = MemorySessionStore(ttl=0)
+        session = store.create("1")
+        self.assertIsNone(store.get(session.id))
+        store = MemorySessionStore(max_sessions=1)
+        first, second = store.create("1"), store.create("2")
+        self.assertIsNone(store.get(first.id))
+        self.assertIs(store.get(second.id), second)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":